@@ -1,8 +1,8 @@
 import re
 from itertools import filterfalse
 from athsymbol import (
-    AthSymbol, AthFunction, AthCustomFunction, SymbolDeath,
-    BuiltinSymbol, NullSymbol, isAthValue,
+    AthSymbol, AthFunction, AthBuiltinFunction, AthCustomFunction, SymbolDeath,
+    BuiltinSymbol, NullSymbol, SymbolChain, isAthValue, flatten,
     )
 
 NULL = NullSymbol()
@@ -20,11 +20,12 @@ class AthBuiltinsDict(dict):
             )
 
 ath_builtins = AthBuiltinsDict(NULL=NULL)
-ath_modules = {'MATH'}
+ath_modules = {'MATH', 'VECTOR'}
 
 def pull_name(arg):
     if isinstance(arg, AthSymbol):
         arg = arg.left
+    arg = flatten(arg)
     if isinstance(arg, str):
         return arg
     raise TypeError('cannot pull grave from non-string')
@@ -85,6 +86,53 @@ def execute_statement(env, *args):
     # For builtin functions, just pass the arguments as is.
     return func, argv
 
+class CallSite(AthBuiltinFunction):
+    """EXECUTE's function for a single EXECUTE statement, which remembers
+    the function it last called and that function's argument names.
+
+    Calls skip execute_statement's checks for as long as the symbol called
+    holds that same function. The number of arguments never changes for
+    a statement, so it only needs checking when the function does.
+    """
+    __slots__ = ('target', 'argfmt')
+
+    def __init__(self):
+        super().__init__('EXECUTE', execute_statement, 0)
+        self.target = None
+        # Argument names of the target, or None if it is a builtin.
+        self.argfmt = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.target})'
+
+    def __call__(self, env, *args):
+        try:
+            func = args[0].right
+        except (IndexError, AttributeError):
+            return execute_statement(env, *args)
+        if func is not self.target or func is None:
+            return self.resolve(env, func, args)
+        argv = args[1:]
+        if self.argfmt is None:
+            return func, argv
+        for value in argv:
+            if type(value) is not AthSymbol:
+                # Values have to be boxed into symbols of their own.
+                return func, {
+                    name: (AthSymbol(left=value) if isAthValue(value) else value)
+                    for name, value in zip(self.argfmt, argv)
+                    }
+        return func, dict(zip(self.argfmt, argv))
+
+    def resolve(self, env, func, args):
+        """Makes a call the slow way, then caches the function called."""
+        call = execute_statement(env, *args)
+        if isinstance(func, AthCustomFunction):
+            self.target, self.argfmt = func, func.argfmt
+        elif isinstance(func, AthBuiltinFunction):
+            self.target, self.argfmt = func, None
+        return call
+
 def inspect_statement(env, index=None):
     if index is None:
         print(ath_builtins)
@@ -131,6 +179,7 @@ def input_statement(env, dst, ech=None):
         sym = AthSymbol(left=value)
         env.set_symbol(dst, sym)
     else:
+        sym.unshare()
         sym.left = value
     return sym
 
@@ -157,7 +206,7 @@ def print_statement(env, *args):
         raise TypeError('print statement empty')
     frmtstr, fmtargs = args[0], args[1:]
     if isinstance(frmtstr, AthSymbol):
-        frmtstr = frmtstr.left
+        frmtstr = flatten(frmtstr.left)
     elif not isinstance(frmtstr, str):
         raise TypeError(
             'First argument must be string or symbol containing string'
@@ -182,14 +231,18 @@ def print_statement(env, *args):
     print(frmtstr, end='', flush=True)
     return frmtstr
 
-def death_statement(env, *syms):
-    # Kills one or a group of symbols, which may change control state.
+def bury_symbols(env, *syms):
+    # Kills one or a group of symbols, returning their names.
     graves = []
     for sym in syms:
         grave = pull_name(sym)
         graves.append(grave)
         env.get_symbol(grave).kill()
-    raise SymbolDeath(graves)
+    return graves
+
+def death_statement(env, *syms):
+    # Kills one or a group of symbols, which may change control state.
+    raise SymbolDeath(bury_symbols(env, *syms))
 
 def replicate_statement(env, dst, src=None):
     dst = pull_name(dst)
@@ -200,6 +253,7 @@ def replicate_statement(env, dst, src=None):
         elif isinstance(src, AthSymbol):
             # If a symbol is replicated, copy it.
             sym = src.copy()
+            sym.thaw()
         elif isAthValue(src):
             # If a value is replicated, set it to left.
             sym = AthSymbol(left=src)
@@ -247,55 +301,79 @@ def enumerate_statement(env, src, dst):
         val = src.left
     else:
         val = src
+    val = flatten(val)
     if not isinstance(val, str):
         raise TypeError('ENUMERATE only takes strings')
 
-    charlist = [AthSymbol(left=char) for char in val]
-    for i in range(len(charlist) - 1):
-        charlist[i].assign_right(charlist[i + 1])
-    charlist[-1].assign_right(AthSymbol(False))
-
-    env.set_symbol(pull_name(dst), charlist[0])
-    return charlist[0]
-
-def bifurcate_statement(env, src, lft, rht):
-    # Split a symbol and assign the values to the two names given.
-    lft = pull_name(lft)
-    rht = pull_name(rht)
-    syms = env.get_symbol(pull_name(src))
-    syml = symr = None
-    if lft != 'NULL':
-        if isinstance(syms.left, AthSymbol):
-            if lft != src:
-                env.set_symbol(lft, syms.left)
-            else:
-                syml = syms.left
-        elif syms.left is None:
-            env.set_symbol(lft, AthSymbol(False))
-        else:
-            env.set_symbol(lft, AthSymbol(left=syms.left))
-    if rht != 'NULL':
-        if isinstance(syms.right, AthSymbol):
-            if rht != src:
-                env.set_symbol(rht, syms.right)
-            else:
-                symr = syms.right
-        elif syms.right is None:
-            env.set_symbol(rht, AthSymbol(False))
-        else:
-            env.set_symbol(rht, AthSymbol(right=syms.right))
-    if syml is not None:
-        syms.copyfrom(syml)
-    elif symr is not None:
-        syms.copyfrom(symr)
+    # The chain indexes into the string itself, so nothing is copied.
+    charlist = SymbolChain(val).node(0)
+    env.set_symbol(pull_name(dst), charlist)
+    return charlist
+
+def range_function(env, *args):
+    # Returns a list of the integers in a range, made as it's walked.
+    bounds = []
+    for arg in args:
+        if isinstance(arg, AthSymbol):
+            arg = arg.left
+        if type(arg) is not int:
+            raise TypeError('RANGE only takes integers')
+        bounds.append(arg)
+    if not 0 < len(bounds) < 4:
+        raise TypeError(f'expected 1 to 3 range bounds, got {len(bounds)}')
+    return SymbolChain(range(*bounds)).node(0)
+
+def split_part(value, side):
+    # The symbol that a name gets for one side of a split symbol.
+    if isinstance(value, AthSymbol):
+        # Whatever gets a name must own what is below it.
+        value.thaw()
+        return value
+    if value is None:
+        return AthSymbol(False)
+    if side == 'left':
+        return AthSymbol(left=value)
+    return AthSymbol(right=value)
+
+def bifurcate_statement(env, src, *dsts):
+    # Split a symbol and assign the values to the names given. Past two
+    # names, each name takes the left of what is right of the one before
+    # it, and the last name takes whatever is right of all of them.
+    *heads, tail = (pull_name(dst) for dst in dsts)
+    syms = node = env.get_symbol(pull_name(src))
+    parts = []
+    for index, name in enumerate(heads):
+        if index:
+            node = split_part(node.right, 'right')
+        parts.append((name, node, 'left'))
+    parts.append((tail, node, 'right'))
+    owner = None
+    for name, node, side in parts:
+        if name == 'NULL':
+            continue
+        value = getattr(node, side)
+        part = split_part(value, side)
+        if name != src or part is not value:
+            env.set_symbol(name, part)
+        elif owner is None:
+            owner = part
+    if owner is not None:
+        syms.copyfrom(owner)
     return NULL
 
-def aggregate_statement(env, dst, lft, rht):
-    # Merge two symbols or values together.
+def aggregate_statement(env, dst, lft, rht, *more):
+    # Merge two symbols or values together. Past two, each value after
+    # the first is merged with the ones after it into a new symbol first.
     dst = pull_name(dst)
     if lft is NULL:
         lft = NULL.copy()
-    if rht is NULL:
+    if more:
+        *mids, rht = (
+            NULL.copy() if item is NULL else item for item in (rht, *more)
+            )
+        for item in reversed(mids):
+            rht = AthSymbol(True, item, rht)
+    elif rht is NULL:
         rht = NULL.copy()
     try:
         syms = env.get_symbol(dst)
@@ -303,6 +381,8 @@ def aggregate_statement(env, dst, lft, rht):
         syms = AthSymbol(True, lft, rht)
         env.set_symbol(dst, syms)
     else:
+        # Nothing borrowed may see refcopy replace syms below it.
+        syms.unshare()
         if isinstance(lft, AthSymbol):
             lft = lft.refcopy(syms)
         if isinstance(rht, AthSymbol):
@@ -319,7 +399,13 @@ def fabricate_statement(env, func):
         sym = AthSymbol(right=func)
         env.set_symbol(func.name, sym)
     else:
-        sym.right = func
+        if sym.right is not func:
+            if isinstance(sym.right, AthCustomFunction):
+                # Redefined functions are interpreted again until they get hot.
+                env.deoptimize(sym.right)
+            sym.unshare()
+            sym.right = func
+            env.deoptimize(func)
     return sym
 
 def divulgate_statement(env, expr):
@@ -351,7 +437,8 @@ ath_builtins.add_builtins(
     REPLICATE=(replicate_statement, 1),
     PROCREATE=(procreate_statement, 1),
     ENUMERATE=(enumerate_statement, 2),
-    BIFURCATE=(bifurcate_statement, 7),
+    RANGE=(range_function, 0),
+    BIFURCATE=(bifurcate_statement, -1),
     AGGREGATE=(aggregate_statement, 1),
     FABRICATE=(fabricate_statement, 0),
     DIVULGATE=(divulgate_statement, 0),
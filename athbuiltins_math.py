@@ -1,8 +1,15 @@
 import math
 import operator
-from athsymbol import AthSymbol, BuiltinSymbol
+from itertools import repeat
+from athsymbol import (
+    AthSymbol, BuiltinSymbol, SymbolChain, vector_types, chain_values,
+    )
+
+# The function and value types of each builtin, for their batched forms.
+math_funcs = {}
 
 def math_builtin(name, func, dtypes):
+    math_funcs[name] = (func, dtypes)
     def math_proxy_func(env, *values):
         args = []
         for value in values:
@@ -78,3 +85,97 @@ builtins_dict = {
     'ISINF': math_builtin('ISINF', math.isinf, (int, float)),
     'ISNAN': math_builtin('ISNAN', math.isnan, (int, float)),
     }
+
+# NumPy functions doing the same as the builtins, for vectors.
+ufunc_names = {
+    'ADDTN': 'add', 'SUBTN': 'subtract', 'MULTP': 'multiply',
+    'INDIV': 'floor_divide', 'FLDIV': 'true_divide', 'INMOD': 'mod',
+    'FNABS': 'absolute', 'FLMOD': 'fmod', 'LDEXP': 'ldexp', 'POWER': 'power',
+    'EXPNP': 'exp', 'EXPM1': 'expm1', 'LOGP1': 'log1p', 'LOGNP': 'log',
+    'LOGDC': 'log10', 'LOGBN': 'log2', 'SQRRT': 'sqrt',
+    'SINCR': 'sin', 'COSCR': 'cos', 'TANCR': 'tan',
+    'ASINC': 'arcsin', 'ACOSC': 'arccos', 'ATANC': 'arctan',
+    'ATAN2': 'arctan2', 'HYPOT': 'hypot',
+    'SINHY': 'sinh', 'COSHY': 'cosh', 'TANHY': 'tanh',
+    'ASINH': 'arcsinh', 'ACOSH': 'arccosh', 'ATANH': 'arctanh',
+    'ISFIN': 'isfinite', 'ISINF': 'isinf', 'ISNAN': 'isnan',
+    }
+# FLOOR, CEILN and TRUNC return ints, which NumPy's versions don't,
+# so they are left to the element-wise loop.
+
+def integer_args(args):
+    # NumPy integers wrap around on overflow where Python's don't, so
+    # arithmetic on nothing but integers is left to the loop as well.
+    for value in args:
+        if type(value) in vector_types:
+            if value.dtype.kind not in 'biu':
+                return False
+        elif type(value) is list:
+            if not all(isinstance(item, int) for item in value):
+                return False
+        elif not isinstance(value, int):
+            return False
+    return True
+
+def batch_builtin(name, func, dtypes):
+    """Applies a MATH builtin across whole lists or vectors in one call.
+    Plain values and symbols holding them are used for every element.
+    """
+    ufunc_name = ufunc_names.get(name)
+    def batch_proxy_func(env, *values):
+        args = []
+        sizes = set()
+        has_vector = False
+        for value in values:
+            if isinstance(value, AthSymbol):
+                if not value.alive or isinstance(value.right, AthSymbol):
+                    value = list(chain_values(value))
+                else:
+                    value = value.left
+            if type(value) in vector_types:
+                has_vector = True
+                sizes.add(len(value))
+            elif type(value) is list:
+                if not all(isinstance(item, dtypes) for item in value):
+                    raise TypeError('invalid numerical type')
+                sizes.add(len(value))
+            elif not isinstance(value, dtypes):
+                raise TypeError('invalid numerical type')
+            args.append(value)
+        if not sizes:
+            raise TypeError(f'{name}_EACH expects a list or vector')
+        if len(sizes) > 1:
+            raise ValueError(f'{name}_EACH got lists of different lengths')
+        if has_vector:
+            # Vectors only exist once NumPy has been imported.
+            import numpy
+            ufunc = getattr(numpy, ufunc_name) if ufunc_name else None
+            # Optional arguments of a builtin, like LOGNP's base, aren't
+            # ones its ufunc takes.
+            if (
+                ufunc is not None
+                and ufunc.nin == len(args)
+                and not integer_args(args)
+                ):
+                try:
+                    with numpy.errstate(all='raise'):
+                        return AthSymbol(left=ufunc(*args))
+                except (FloatingPointError, ValueError):
+                    # Redo it element-wise so the builtin itself either
+                    # raises its own error or gives Python's result.
+                    pass
+            args = [
+                value.tolist() if type(value) in vector_types else value
+                for value in args
+                ]
+        columns = [value if type(value) is list else repeat(value) for value in args]
+        results = list(map(func, *columns))
+        if has_vector:
+            return AthSymbol(left=numpy.array(results))
+        return SymbolChain(results).node(0)
+    return BuiltinSymbol.from_builtin(f'{name}_EACH', batch_proxy_func, 0)
+
+builtins_dict.update(
+    (f'{name}_EACH', batch_builtin(name, *math_funcs[name]))
+    for name in list(math_funcs)
+    )
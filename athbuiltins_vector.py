@@ -0,0 +1,54 @@
+import numpy
+from athsymbol import (
+    AthSymbol, BuiltinSymbol, SymbolChain, add_vector_type, chain_values,
+    )
+
+add_vector_type(numpy.ndarray)
+
+def vector_function(env, src):
+    # Packs the numbers of a list into a vector.
+    values = chain_values(src)
+    if isinstance(values, range):
+        vector = numpy.arange(values.start, values.stop, values.step)
+    elif all(type(value) in (int, float, complex) for value in values):
+        vector = numpy.array(values)
+    else:
+        raise TypeError('invalid numerical type')
+    return AthSymbol(left=vector)
+
+def chain_function(env, src):
+    # Unpacks a vector into a list of its numbers.
+    return SymbolChain(pull_vector(src).tolist()).node(0)
+
+def pull_vector(value):
+    if isinstance(value, AthSymbol):
+        value = value.left
+    if isinstance(value, numpy.ndarray):
+        return value
+    raise TypeError('expected a vector')
+
+def reduction_builtin(name, func):
+    def reduction_proxy_func(env, src):
+        vector = pull_vector(src)
+        if not vector.size:
+            raise ValueError(f'{name} of an empty vector')
+        value = func(vector)
+        if isinstance(value, numpy.generic):
+            # Vectors of ints too big for NumPy hold Python ints already.
+            value = value.item()
+        return AthSymbol(left=value)
+    return BuiltinSymbol.from_builtin(name, reduction_proxy_func, 0)
+
+builtins_dict = {
+    # Conversions
+    'VECTR': BuiltinSymbol.from_builtin('VECTR', vector_function, 0),
+    'CHAIN': BuiltinSymbol.from_builtin('CHAIN', chain_function, 0),
+    # Reductions
+    'VSIZE': BuiltinSymbol.from_builtin(
+        'VSIZE', lambda env, src: AthSymbol(left=pull_vector(src).size), 0
+        ),
+    'VSUMM': reduction_builtin('VSUMM', numpy.sum),
+    'VMINM': reduction_builtin('VMINM', numpy.min),
+    'VMAXM': reduction_builtin('VMAXM', numpy.max),
+    'VMEAN': reduction_builtin('VMEAN', numpy.mean),
+    }
@@ -0,0 +1,462 @@
+"""Translates whole ~ATH programs into Python modules.
+
+Every FABRICATEd function and the top level become Python functions,
+~ATH loops become while loops that push a stack frame and check their
+control variable, and conditional jumps become if/else blocks. Statement
+lists whose jumps don't nest like DEBATE/UNLESS chains are translated into
+a while loop stepping a statement counter instead.
+
+Generated modules only need the runtime support at the top of this module,
+and run the program when executed as scripts.
+"""
+import os
+import sys
+import importlib.util
+from athsymbol import AthSymbol, SymbolDeath, AthBuiltinFunction, AthCustomFunction
+from athstmt import (
+    ath_builtins, ThisSymbol,
+    LiteralToken, IdentifierToken,
+    AthStatement, AthTokenStatement, TildeAthLoop,
+    UnaryExpr, BnaryExpr, CondiJump,
+    )
+from athgrammar import ath_parser
+from athinterpreter import AthStackFrame, TildeAthInterp
+
+# Non-tail calls nest on the Python stack, so give them some room.
+RECURSION_LIMIT = 100_000
+
+# Bumped whenever generated modules call into the runtime differently,
+# or are generated differently.
+CODEGEN_VERSION = 3
+
+
+class TailCall(object):
+    """Returned by a function body to be replaced with a call to a function."""
+    __slots__ = ('func', 'scope_vars')
+
+    def __init__(self, func, scope_vars):
+        self.func = func
+        self.scope_vars = scope_vars
+
+
+class CompiledBody(object):
+    """Stands in for the statement list of a generated function."""
+    __slots__ = ('pendant', 'run')
+
+    def __init__(self, pendant, run):
+        self.pendant = pendant
+        self.run = run
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.pendant!r}, {self.run.__name__})'
+
+
+class CodegenInterp(TildeAthInterp):
+    """Runs ~ATH programs translated into Python modules.
+
+    Generated code keeps stack frames the same way the trampoline does,
+    so builtins and dynamic scope work unchanged.
+    """
+    __slots__ = ()
+
+    def is_killed(self, exc, pendant):
+        """Returns whether a death kills the running block's control variable."""
+        graves = exc.args[0]
+        if 'THIS' in graves:
+            # End the program only when THIS is killed.
+            sys.exit(0)
+        return pendant in graves
+
+    def unwind(self, exc):
+        """Leaves a killed function, killing it again in the caller."""
+        graves = exc.args[0]
+        self.stack.pop()
+        for grave in graves:
+            self.get_symbol(grave).kill()
+        raise SymbolDeath(graves)
+
+    def execute(self, site, *args):
+        func, scope_vars = site(self, *args)
+        if isinstance(func, AthBuiltinFunction):
+            return func(self, *scope_vars)
+        return self.call_function(func, scope_vars)
+
+    def execute_last(self, site, *args):
+        """Runs a call in tail position, which is a tail call when made
+        from a function body.
+        """
+        func, scope_vars = site(self, *args)
+        if isinstance(func, AthBuiltinFunction):
+            func(self, *scope_vars)
+        elif self.stack[-1].exec_state == self.FUNCEXEC_STATE:
+            return TailCall(func, scope_vars)
+        else:
+            self.call_function(func, scope_vars)
+
+    def divulgate_call(self, site, *args):
+        func, scope_vars = site(self, *args)
+        if isinstance(func, AthBuiltinFunction):
+            return func(self, *scope_vars)
+        return TailCall(func, scope_vars)
+
+    def call_function(self, func, scope_vars):
+        """Runs a function in a new frame and returns its return value."""
+        frame = AthStackFrame(scope_vars=scope_vars, exec_state=self.FUNCEXEC_STATE)
+        self.stack.append(frame)
+        while True:
+            value = func.body.run(self)
+            if type(value) is TailCall:
+                func = value.func
+                self.stack.replace_scope(value.scope_vars)
+                continue
+            self.stack.pop()
+            return AthSymbol(False) if value is None else value
+
+    def run_program(self, fname, program):
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+        ath_builtins['THIS'] = ThisSymbol(fname, program)
+        self.stack.append(AthStackFrame())
+        value = program.run(self)
+        if value is not None:
+            # Returning from the top level leaves no frame to return to.
+            self.stack.pop()
+            if type(value) is TailCall:
+                self.call_function(value.func, value.scope_vars)
+            raise RuntimeError('All stack frames destroyed!!!!!')
+        sys.exit(0)
+
+    def exec_stmts(self, fname, stmts):
+        program = {'__name__': f'gen_{fname[:-5]}'}
+        exec(compile(generate(fname, stmts), fname, 'exec'), program)
+        self.run_program(fname, program['program'])
+
+    def interpret(self, fname, force):
+        if not fname.endswith('.~ATH'):
+            sys.stderr.write('IOError: script must be a ~ATH file')
+            sys.exit(IOError)
+        modname = f'gen_{fname[:-5]}'
+        module = None
+        if not force and os.path.isfile(f'{modname}.py'):
+            module = load_module(modname)
+            if getattr(module, 'codegen_version', None) != CODEGEN_VERSION:
+                module = None
+        if module is None:
+            with open(os.path.join('script', fname), 'r') as script_file:
+                source = generate(fname, ath_parser(script_file.read()))
+            with open(f'{modname}.py', 'w') as genfile:
+                genfile.write(source)
+            module = load_module(modname)
+        self.run_program(fname, module.program)
+
+
+def load_module(modname):
+    """Loads a generated module from the working directory."""
+    spec = importlib.util.spec_from_file_location(modname, f'{modname}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Kinds of statement lists, by the stack frame state they run in.
+FUNCEXEC_BLOCK = TildeAthInterp.FUNCEXEC_STATE
+TILDEATH_BLOCK = TildeAthInterp.TILDEATH_STATE
+TILALIVE_BLOCK = TildeAthInterp.TILALIVE_STATE
+
+
+def indent(lines, level=1):
+    return ['    ' * level + line for line in lines]
+
+
+def is_token_stmt(stmt, name):
+    return isinstance(stmt, AthTokenStatement) and stmt.name == name
+
+
+def is_jump(stmt):
+    return type(stmt) is CondiJump and stmt.args[0] is None
+
+
+def structure(stmts, start, stop):
+    """Nests the statements from start to stop into if/else blocks.
+
+    Returns a list of statement indices and ('if', index, then, else)
+    tuples, or None if some jump leaves the statements it should nest in.
+    Jumps past the end of the list go to its end.
+    """
+    tree = []
+    index = start
+    while index < stop:
+        stmt = stmts[index]
+        if type(stmt) is not CondiJump:
+            tree.append(index)
+            index += 1
+            continue
+        cond, jlen = stmt.args
+        target = min(index + 1 + jlen, len(stmts))
+        if not index < target <= stop:
+            return None
+        if cond is None:
+            # Anything skipped over is unreachable.
+            index = target
+            continue
+        # A then block ending in a jump past an else block.
+        end = None
+        if target - 1 > index and is_jump(stmts[target - 1]):
+            end = min(target + stmts[target - 1].args[1], len(stmts))
+            if not target <= end <= stop:
+                end = None
+        if end is None:
+            then, orelse = structure(stmts, index + 1, target), []
+            end = target
+        else:
+            then = structure(stmts, index + 1, target - 1)
+            orelse = structure(stmts, target, end)
+        if then is None or orelse is None:
+            return None
+        tree.append(('if', index, then, orelse))
+        index = end
+    return tree
+
+
+class BlockContext(object):
+    """What the statement list being translated runs in."""
+    __slots__ = ('kind', 'pendant', 'counter', 'depth')
+
+    def __init__(self, kind, pendant, counter=None, depth=0):
+        self.kind = kind
+        self.pendant = pendant
+        # Name of the statement counter, for lists that aren't structured.
+        self.counter = counter
+        # Number of loops the list is nested in.
+        self.depth = depth
+
+
+class CodeGenerator(object):
+    """Translates a ~ATH program into the source of a Python module."""
+    __slots__ = ('builtins', 'defs', 'consts', 'nfuncs', 'nsites')
+
+    def __init__(self):
+        # Names of the builtin statements the program uses.
+        self.builtins = []
+        self.defs = []
+        self.consts = []
+        self.nfuncs = 0
+        self.nsites = 0
+
+    def builtin(self, name):
+        if name not in self.builtins:
+            self.builtins.append(name)
+        return f'stmt_{name}'
+
+    def gen_function(self, func):
+        """Translates a function's body, returning the name its function
+        object is bound to in the module.
+        """
+        self.nfuncs += 1
+        index = self.nfuncs
+        body = self.gen_body(f'body_{index}', func.body)
+        self.consts.append(
+            f'func_{index} = AthCustomFunction('
+            f'{func.name!r}, {func.argfmt!r}, CompiledBody({func.body.pendant!r}, {body}))'
+            )
+        return f'func_{index}'
+
+    def gen_value(self, arg, is_name=False):
+        if isinstance(arg, LiteralToken):
+            return repr(arg.value)
+        if isinstance(arg, IdentifierToken):
+            if is_name:
+                return repr(arg.name)
+            return f'env.get_symbol({arg.name!r})'
+        if isinstance(arg, AthStatement):
+            return self.gen_expr(arg)
+        if isinstance(arg, AthCustomFunction):
+            return self.gen_function(arg)
+        return repr(arg)
+
+    def gen_args(self, stmt):
+        bitmask = stmt.func.bitmask
+        return ', '.join(
+            self.gen_value(arg, bitmask < 0 or bitmask & (1 << index))
+            for index, arg in enumerate(stmt.args)
+            )
+
+    def gen_call_args(self, stmt):
+        """Translates the arguments of an EXECUTE statement, preceded by
+        the call site cache the statement gets in the module.
+        """
+        self.nsites += 1
+        site = f'site_{self.nsites}'
+        self.consts.append(f'{site} = CallSite()')
+        args = self.gen_args(stmt)
+        return f'{site}, {args}' if args else site
+
+    def gen_expr(self, stmt):
+        if type(stmt) is UnaryExpr:
+            opr, val = stmt.args
+            return f'unopr_expression(env, {opr!r}, {self.gen_value(val)})'
+        if type(stmt) is BnaryExpr:
+            opr, lft, rht = stmt.args
+            return (
+                f'biopr_expression(env, {opr!r}, '
+                f'{self.gen_value(lft)}, {self.gen_value(rht)})'
+                )
+        if is_token_stmt(stmt, 'EXECUTE'):
+            return f'env.execute({self.gen_call_args(stmt)})'
+        args = self.gen_args(stmt)
+        return f'{self.builtin(stmt.name)}(env{", " if args else ""}{args})'
+
+    def on_death(self, ctx):
+        """Returns what a statement does when its control variable dies."""
+        if ctx.kind == FUNCEXEC_BLOCK:
+            action = ['env.unwind(exc)']
+        elif ctx.kind == TILDEATH_BLOCK:
+            action = ['env.stack.pop()', 'break']
+        elif ctx.counter:
+            action = [f'{ctx.counter} = 0', 'continue']
+        else:
+            action = ['continue']
+        return [f'if env.is_killed(exc, {ctx.pendant!r}):', *indent(action)]
+
+    def guard(self, lines, ctx, abandon=()):
+        """Wraps a statement so that symbol deaths skip the rest of it."""
+        return [
+            'try:', *indent(lines),
+            'except SymbolDeath as exc:', *indent(self.on_death(ctx)), *indent(abandon),
+            ]
+
+    def gen_loop(self, stmt, ctx):
+        body, state = stmt.body, stmt.state
+        alive = f'env.get_symbol({body.pendant!r}).alive'
+        kind = TILDEATH_BLOCK + int(state)
+        lines = [
+            f'if {alive} != {state}:',
+            f'    env.stack.append(AthStackFrame(exec_state={kind}))',
+            ]
+        tree = structure(body, 0, len(body))
+        if tree is None:
+            counter = f'pc{ctx.depth + 1}'
+            loop_ctx = BlockContext(kind, body.pendant, counter, ctx.depth + 1)
+            lines += indent(self.gen_machine(body, loop_ctx, [
+                f'if {alive} == {state}:',
+                '    env.stack.pop()',
+                '    break',
+                f'{counter} = 0',
+                ]))
+        else:
+            loop_ctx = BlockContext(kind, body.pendant, None, ctx.depth + 1)
+            lines += indent([
+                'while True:',
+                *indent(self.gen_tree(body, tree, loop_ctx)),
+                f'    if {alive} == {state}:',
+                '        env.stack.pop()',
+                '        break',
+                ])
+        return lines
+
+    def gen_stmt(self, stmts, index, ctx):
+        stmt = stmts[index]
+        if isinstance(stmt, TildeAthLoop):
+            return self.gen_loop(stmt, ctx)
+        if is_token_stmt(stmt, 'DIVULGATE'):
+            expr, = stmt.args
+            if is_token_stmt(expr, 'EXECUTE'):
+                lines = [f'return env.divulgate_call({self.gen_call_args(expr)})']
+            else:
+                lines = [
+                    f'value = {self.gen_value(expr)}',
+                    'if value is not None:',
+                    '    return value',
+                    ]
+            return self.guard(lines, ctx, ['return AthSymbol(False)'])
+        if is_token_stmt(stmt, 'EXECUTE') and index in stmts.tail_positions():
+            if ctx.kind == FUNCEXEC_BLOCK:
+                return self.guard([
+                    f'tail = env.execute_last({self.gen_call_args(stmt)})',
+                    'if tail is not None:',
+                    '    return tail',
+                    ], ctx)
+        if type(stmt) is CondiJump:
+            cond, jlen = stmt.args
+            target = min(index + 1 + jlen, len(stmts))
+            if cond is None:
+                return [f'{ctx.counter} = {target}']
+            return self.guard([
+                f'if not {self.gen_value(cond)}:',
+                f'    {ctx.counter} = {target}',
+                ], ctx)
+        return self.guard([self.gen_expr(stmt)], ctx)
+
+    def gen_tree(self, stmts, tree, ctx):
+        lines = []
+        for node in tree:
+            if not isinstance(node, tuple):
+                lines += self.gen_stmt(stmts, node, ctx)
+                continue
+            _, index, then, orelse = node
+            cond, _ = stmts[index].args
+            # A death in the condition skips the jump past the then block.
+            lines += self.guard([f'cond = {self.gen_value(cond)}'], ctx, ['cond = True'])
+            lines += ['if cond:', *indent(self.gen_tree(stmts, then, ctx) or ['pass'])]
+            if orelse:
+                lines += ['else:', *indent(self.gen_tree(stmts, orelse, ctx))]
+        return lines
+
+    def gen_machine(self, stmts, ctx, at_end):
+        """Translates statements into a loop stepping a statement counter."""
+        counter = ctx.counter
+        lines = [f'{counter} = 0', 'while True:']
+        for index in range(len(stmts)):
+            lines += indent([
+                f'{"el" if index else ""}if {counter} == {index}:',
+                f'    {counter} = {index + 1}',
+                *indent(self.gen_stmt(stmts, index, ctx)),
+                ])
+        if stmts:
+            lines += indent(['else:', *indent(at_end)])
+        else:
+            lines += indent(at_end)
+        return lines
+
+    def gen_body(self, name, stmts):
+        """Translates the statements of a function or the top level
+        into a Python function.
+        """
+        tree = structure(stmts, 0, len(stmts))
+        if tree is None:
+            ctx = BlockContext(FUNCEXEC_BLOCK, stmts.pendant, 'pc0')
+            lines = self.gen_machine(stmts, ctx, ['return None'])
+        else:
+            ctx = BlockContext(FUNCEXEC_BLOCK, stmts.pendant)
+            lines = self.gen_tree(stmts, tree, ctx) or ['pass']
+        self.defs.append('\n'.join([f'def {name}(env):', *indent(lines)]))
+        return name
+
+    def generate(self, fname, stmts):
+        body = self.gen_body('body_0', stmts)
+        return '\n'.join([
+            '#!/usr/bin/env python',
+            f'"""Generated from {fname} by athcodegen."""',
+            'from athsymbol import AthSymbol, SymbolDeath, AthCustomFunction',
+            'from athstmt import ath_builtins, unopr_expression, biopr_expression',
+            'from athbuiltins_default import CallSite',
+            'from athinterpreter import AthStackFrame',
+            'from athcodegen import CompiledBody, CodegenInterp',
+            '',
+            f'codegen_version = {CODEGEN_VERSION}',
+            '',
+            *(f'stmt_{name} = ath_builtins[{name!r}].right' for name in self.builtins),
+            '',
+            '\n\n'.join(self.defs),
+            '',
+            *self.consts,
+            f'program = CompiledBody({stmts.pendant!r}, {body})',
+            '',
+            "if __name__ == '__main__':",
+            f'    CodegenInterp().run_program({fname!r}, program)',
+            '',
+            ])
+
+
+def generate(fname, stmts):
+    """Returns the source of a Python module running a ~ATH program."""
+    return CodeGenerator().generate(fname, stmts)
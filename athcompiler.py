@@ -0,0 +1,340 @@
+"""Execution engine that compiles ~ATH statement lists into Python closures.
+
+Each statement list is compiled once into a list of closures, one per
+statement, which evaluate their operands directly and call their builtins
+instead of going through the evaluation trampoline. Stack frames are kept
+the same way the trampoline keeps them, so builtins, native statements and
+dynamic scope work unchanged.
+"""
+import sys
+from athsymbol import AthSymbol, SymbolDeath, AthBuiltinFunction
+from athstmt import (
+    ath_builtins, ThisSymbol,
+    AthTokenStatement, TildeAthLoop, CondiJump, NativeStatement,
+    ARG_CONST, ARG_LOOKUP, ARG_EVAL,
+    )
+from athinterpreter import TildeAthInterp
+
+# Non-tail calls nest on the Python stack, so give them some room.
+RECURSION_LIMIT = 100_000
+
+
+class Divulgation(Exception):
+    """Raised by DIVULGATE to leave the current frame with a value."""
+
+
+class TailCall(Exception):
+    """Raised to replace the current frame with a call to a function."""
+
+
+def is_token_stmt(stmt, name):
+    return isinstance(stmt, AthTokenStatement) and stmt.name == name
+
+
+def compile_operand(opcode, operand):
+    """Compiles an argument into a function getting its value."""
+    if opcode == ARG_LOOKUP:
+        return lambda env: env.get_symbol(operand)
+    if opcode == ARG_CONST:
+        return lambda env: operand
+    return compile_expr(operand)
+
+
+def compile_call(stmt):
+    """Compiles a statement into a function calling the statement's function
+    on the values of its arguments.
+
+    The statement's function is looked up on every call, so that nodes which
+    quicken themselves keep doing so.
+    """
+    if stmt.argops is None:
+        stmt.classify()
+    getters = [compile_operand(*argop) for argop in stmt.argops]
+    if not getters:
+        return lambda env: stmt.func(env)
+    if len(getters) == 1:
+        arg, = getters
+        return lambda env: stmt.func(env, arg(env))
+    if len(getters) == 2:
+        lft, rht = getters
+        return lambda env: stmt.func(env, lft(env), rht(env))
+    if len(getters) == 3:
+        fst, snd, trd = getters
+        return lambda env: stmt.func(env, fst(env), snd(env), trd(env))
+    return lambda env: stmt.func(env, *[get(env) for get in getters])
+
+
+def compile_execute(stmt):
+    """Compiles an EXECUTE statement into a function calling the function
+    it references and returning the result.
+    """
+    get_call = compile_call(stmt)
+    def execute(env):
+        func, scope_vars = get_call(env)
+        if isinstance(func, AthBuiltinFunction):
+            return func(env, *scope_vars)
+        return env.call_function(func, scope_vars)
+    return execute
+
+
+def compile_expr(stmt):
+    """Compiles an expression into a function returning its value."""
+    if is_token_stmt(stmt, 'EXECUTE'):
+        return compile_execute(stmt)
+    return compile_call(stmt)
+
+
+def take_jump(env, jlen):
+    """Moves the current frame past a jump. Like on the trampoline,
+    landing just after a DIVULGATE returns the jump's dead result.
+    """
+    nodes = env.stack[-1].iter_nodes
+    nodes.index += jlen
+    if nodes.get_current().name == 'DIVULGATE':
+        raise Divulgation(AthSymbol(False))
+
+
+def compile_jump(stmt):
+    cond, jlen = stmt.args
+    if cond is None:
+        def jump(env):
+            take_jump(env, jlen)
+        return jump
+    if stmt.argops is None:
+        stmt.classify()
+    get_cond = compile_operand(*stmt.argops[0])
+    def condi_jump(env):
+        if not get_cond(env):
+            take_jump(env, jlen)
+    return condi_jump
+
+
+def compile_divulgate(stmt):
+    """Compiles a return statement, which returns from a function or
+    breaks out of a loop.
+
+    Returning the result of calling a function makes a tail call,
+    which replaces the current frame with the called function's frame.
+    """
+    if stmt.argops is None:
+        stmt.classify()
+    (opcode, operand), = stmt.argops
+    if opcode == ARG_EVAL and is_token_stmt(operand, 'EXECUTE'):
+        get_call = compile_call(operand)
+        def divulgate_call(env):
+            func, scope_vars = get_call(env)
+            if isinstance(func, AthBuiltinFunction):
+                raise Divulgation(stmt.func(env, func(env, *scope_vars)))
+            raise TailCall(func, scope_vars)
+        return divulgate_call
+    get_value = compile_call(stmt)
+    def divulgate(env):
+        value = get_value(env)
+        if value is not None:
+            raise Divulgation(value)
+    return divulgate
+
+
+def compile_last_execute(stmt):
+    """Compiles a function call in tail position, which makes a tail call
+    when the list it is in is a function body.
+    """
+    get_call = compile_call(stmt)
+    def execute_last(env):
+        func, scope_vars = get_call(env)
+        if isinstance(func, AthBuiltinFunction):
+            func(env, *scope_vars)
+        elif env.stack[-1].exec_state == env.FUNCEXEC_STATE:
+            raise TailCall(func, scope_vars)
+        else:
+            env.call_function(func, scope_vars)
+    return execute_last
+
+
+def compile_loop(stmt):
+    state, body = stmt.state, stmt.body
+    def tildeath(env):
+        env.run_loop(state, body)
+    return tildeath
+
+
+def compile_native(stmt, is_tail):
+    """Compiles a native statement, which falls back to running the
+    statement it replaced if it can't handle the current state.
+    """
+    dispatch = stmt.dispatch
+    fallback = compile_stmt(stmt.fallback, is_tail)
+    def native(env):
+        if not dispatch(env):
+            fallback(env)
+    return native
+
+
+def compile_stmt(stmt, is_tail=False):
+    """Compiles a statement into a function running it."""
+    if isinstance(stmt, TildeAthLoop):
+        return compile_loop(stmt)
+    if isinstance(stmt, NativeStatement):
+        return compile_native(stmt, is_tail)
+    if type(stmt) is CondiJump:
+        return compile_jump(stmt)
+    if is_token_stmt(stmt, 'DIVULGATE'):
+        return compile_divulgate(stmt)
+    if is_token_stmt(stmt, 'EXECUTE'):
+        if is_tail:
+            return compile_last_execute(stmt)
+        return compile_execute(stmt)
+    return compile_expr(stmt)
+
+
+def compile_block(stmts):
+    """Compiles a statement list into a list of functions running
+    each statement.
+    """
+    tails = stmts.tail_positions()
+    return [compile_stmt(stmt, index in tails) for index, stmt in enumerate(stmts)]
+
+
+class ClosureInterp(TildeAthInterp):
+    """Runs ~ATH programs by compiling their statement lists into closures.
+
+    Loops and function calls nest on the Python stack instead of being
+    trampolined, except for tail calls, which reuse the caller's frame.
+    """
+    __slots__ = ('blocks',)
+
+    def __init__(self):
+        super().__init__()
+        # Compiled statement lists, with the lists themselves kept alive.
+        self.blocks = {}
+
+    def get_block(self, stmts):
+        """Returns the compiled form of a statement list."""
+        try:
+            return self.blocks[id(stmts)][1]
+        except KeyError:
+            code = compile_block(stmts)
+            self.blocks[id(stmts)] = (stmts, code)
+            return code
+
+    def run_block(self, frame, code):
+        """Runs compiled statements in the top frame until they run out.
+
+        Returns True if the frame was popped because its control variable
+        was killed. Divulgation and TailCall are left for the caller.
+        """
+        nodes = frame.iter_nodes
+        while nodes.index < len(code):
+            stmt = code[nodes.index]
+            nodes.index += 1
+            try:
+                stmt(self)
+            except SymbolDeath as exc:
+                graves = exc.args[0]
+                if 'THIS' in graves:
+                    # End the program only when THIS is killed.
+                    sys.exit(0)
+                if nodes.pendant in graves:
+                    state = frame.exec_state
+                    if state == self.TILALIVE_STATE:
+                        # If in keep-dead loop, force the loop to repeat.
+                        nodes.reset()
+                    else:
+                        self.stack.drop()
+                        if state == self.FUNCEXEC_STATE:
+                            # Killing a function kills it again in the caller.
+                            for grave in graves:
+                                self.get_symbol(grave).kill()
+                            raise SymbolDeath(graves)
+                        return True
+                if nodes.get_current().name == 'DIVULGATE':
+                    raise Divulgation(AthSymbol(False))
+        return False
+
+    def run_loop(self, state, body):
+        """Runs a ~ATH loop in a new frame until its control variable
+        is alive, or dead for ~ATH(!X) loops.
+        """
+        if self.get_symbol(body.pendant).alive == state:
+            return
+        frame = self.stack.push(body, self.TILDEATH_STATE + int(state))
+        self.resume_loop(frame, state, body)
+
+    def resume_loop(self, frame, state, body):
+        """Runs a ~ATH loop from where its frame is until it ends."""
+        code = self.get_block(body)
+        while True:
+            try:
+                if self.run_block(frame, code):
+                    return
+            except Divulgation:
+                self.stack.drop()
+                return
+            except TailCall as exc:
+                self.stack.drop()
+                self.call_function(*exc.args)
+                return
+            if self.get_symbol(body.pendant).alive == state:
+                self.stack.drop()
+                return
+            frame.iter_nodes.reset()
+
+    def call_function(self, func, scope_vars):
+        """Runs a function in a new frame and returns its return value."""
+        frame = self.stack.push(func.body, self.FUNCEXEC_STATE, scope_vars)
+        while True:
+            try:
+                self.run_block(frame, self.get_block(func.body))
+            except Divulgation as exc:
+                self.stack.drop()
+                return exc.args[0]
+            except TailCall as exc:
+                func, scope_vars = exc.args
+                self.stack.replace_scope(scope_vars)
+                frame.iter_nodes.restart(func.body)
+                continue
+            self.stack.drop()
+            return AthSymbol(False)
+
+    def deoptimize(self, func):
+        super().deoptimize(func)
+        self.blocks.pop(id(func.body), None)
+
+    def exec_stmts(self, fname, stmts):
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+        ath_builtins['THIS'] = ThisSymbol(fname, stmts)
+        frame = self.stack.push(stmts, self.TOPLEVEL_STATE)
+        self.ast = frame.iter_nodes
+        try:
+            self.run_block(frame, self.get_block(stmts))
+        except (Divulgation, TailCall) as exc:
+            # Returning from the top level leaves no frame to return to.
+            self.stack.pop()
+            if isinstance(exc, TailCall):
+                self.call_function(*exc.args)
+            raise RuntimeError('All stack frames destroyed!!!!!')
+        sys.exit(0)
+
+
+class TieredInterp(ClosureInterp):
+    """Runs ~ATH programs on the trampoline, compiling functions and loops
+    into closures once they have been called or looped through often.
+
+    Compiled code only runs the functions it calls compiled too, so hot
+    functions keep the calls they make off the trampoline.
+    """
+    __slots__ = ()
+    # Default number of calls or iterations before compiling.
+    HOT_THRESHOLD = 1000
+
+    def __init__(self):
+        super().__init__()
+        self.hot_threshold = self.HOT_THRESHOLD
+
+    def tier_up_loop(self, frame, state, body):
+        """Runs the rest of a hot loop compiled."""
+        self.resume_loop(frame, state, body)
+
+    def exec_stmts(self, fname, stmts):
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+        TildeAthInterp.exec_stmts(self, fname, stmts)
@@ -265,8 +265,8 @@ def procrstmt():
 def bfctstmt():
     """Parses the bifurcate statement."""
     def breakdown(tokens):
-        kwd, src, _, lft, _, rht, _, _ = tokens
-        return AthTokenStatement(kwd, (src, lft, rht))
+        kwd, src, _, lft, _, rht, more, _, _ = tokens
+        return AthTokenStatement(kwd, (src, lft, rht, *(dst for _, dst in more)))
     return (
         kwdparser('BIFURCATE')
         + idnparser
@@ -274,6 +274,7 @@ def bfctstmt():
         + varparser
         + dlmparser(',')
         + varparser
+        + RepeatParser(dlmparser(',') + varparser)
         + dlmparser(']')
         + dlmparser(';')
         ^ breakdown
@@ -282,14 +283,15 @@ def bfctstmt():
 def aggrstmt():
     """Parses the aggregate statement."""
     def breakdown(tokens):
-        kwd, _, lft, _, rht, _, dst, _ = tokens
-        return AthTokenStatement(kwd, (dst, lft, rht))
+        kwd, _, lft, _, rht, more, _, dst, _ = tokens
+        return AthTokenStatement(kwd, (dst, lft, rht, *(src for _, src in more)))
     return (
         kwdparser('AGGREGATE')
         + dlmparser('[')
         + exprparser()
         + dlmparser(',')
         + exprparser()
+        + RepeatParser(dlmparser(',') + exprparser())
         + dlmparser(']')
         + varparser
         + dlmparser(';')
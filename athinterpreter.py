@@ -7,13 +7,29 @@ from athsymbol import AthSymbol, SymbolDeath, AthBuiltinFunction, AthCustomFunct
 from athstmt import(
 	ath_builtins, ThisSymbol,
     LiteralToken, IdentifierToken, 
-	AthStatement, AthTokenStatement, TildeAthLoop,
+	AthStatement, AthTokenStatement, TildeAthLoop, NativeStatement,
+	ARG_CONST, ARG_LOOKUP, ARG_EVAL,
 	)
+from athbuiltins_default import bury_symbols
 from athgrammar import ath_parser
+from athoptimizer import optimize, fusion_table
 
 __version__ = '1.6.2'
 __author__ = 'virtuNat'
 
+# DIE's function, which the trampoline runs without raising SymbolDeath.
+death_function = ath_builtins['DIE'].right
+
+# Execution engines selectable from the command line, by module and class.
+engines = {
+    'trampoline': ('athinterpreter', 'TildeAthInterp'),
+    'closure': ('athcompiler', 'ClosureInterp'),
+    'bytecode': ('athvm', 'BytecodeInterp'),
+    'codegen': ('athcodegen', 'CodegenInterp'),
+    'tiered': ('athcompiler', 'TieredInterp'),
+    'tracing': ('athtracer', 'TracingInterp'),
+    }
+
 
 class AthStackFrame(object):
     """Keeps a record of all symbols declared in a given scope.
@@ -47,9 +63,102 @@ class AthStackFrame(object):
         return self.iter_nodes.stmts[idx - 1 if idx > 0 else 0]
 
 
+class FrameStack(list):
+    """Stack of frames that keeps the symbols every name is bound to,
+    innermost last, so that dynamic scope lookups don't walk the stack.
+
+    Frames must be pushed and popped with append and pop, and symbols
+    set in the top frame or its scope replaced through this stack.
+
+    Frames dropped instead of popped are kept to be reused by push, so
+    that calls and loops don't allocate a frame every time they run.
+    """
+    __slots__ = ('bindings', 'free')
+
+    def __init__(self):
+        super().__init__()
+        self.bindings = {}
+        # Dropped frames, with their scope and evaluation state cleared.
+        self.free = []
+
+    def bind_scope(self, scope_vars):
+        bindings = self.bindings
+        for name, value in scope_vars.items():
+            try:
+                bindings[name].append(value)
+            except KeyError:
+                bindings[name] = [value]
+
+    def unbind_scope(self, scope_vars):
+        bindings = self.bindings
+        for name in scope_vars:
+            values = bindings[name]
+            if len(values) > 1:
+                values.pop()
+            else:
+                del bindings[name]
+
+    def append(self, frame):
+        super().append(frame)
+        if frame.scope_vars:
+            self.bind_scope(frame.scope_vars)
+
+    def pop(self):
+        frame = super().pop()
+        if frame.scope_vars:
+            self.unbind_scope(frame.scope_vars)
+        return frame
+
+    def clear(self):
+        super().clear()
+        self.bindings.clear()
+
+    def push(self, stmts, exec_state, scope_vars=None):
+        """Pushes a frame running a statement list from the start."""
+        try:
+            frame = self.free.pop()
+        except IndexError:
+            frame = AthStackFrame(scope_vars, stmts.iter_nodes(), exec_state)
+        else:
+            if scope_vars is not None:
+                frame.scope_vars = scope_vars
+            frame.iter_nodes.restart(stmts)
+            frame.exec_state = exec_state
+        self.append(frame)
+        return frame
+
+    def drop(self):
+        """Pops the top frame to be reused. Nothing may hold on to it."""
+        frame = self.pop()
+        frame.scope_vars.clear()
+        frame.eval_state.clear()
+        self.free.append(frame)
+
+    def bind(self, name, value):
+        """Binds a name in the top frame."""
+        scope_vars = self[-1].scope_vars
+        if name in scope_vars:
+            self.bindings[name][-1] = value
+        else:
+            try:
+                self.bindings[name].append(value)
+            except KeyError:
+                self.bindings[name] = [value]
+        scope_vars[name] = value
+
+    def replace_scope(self, scope_vars):
+        """Replaces the names bound in the top frame, for tail calls."""
+        frame = self[-1]
+        if frame.scope_vars:
+            self.unbind_scope(frame.scope_vars)
+        frame.scope_vars = scope_vars
+        if scope_vars:
+            self.bind_scope(scope_vars)
+
+
 class TildeAthInterp(object):
     """Runs the finite state machine governing ~ATH program behavior."""
-    __slots__ = ('modules', 'stack', 'nodes', 'ast', 'exec_state')
+    __slots__ = ('modules', 'stack', 'nodes', 'ast', 'exec_state', 'hot_threshold', 'counters')
     # Execution state final variables.
     TOPLEVEL_STATE = 0 # Toplevel imperative execution
     TILDEATH_STATE = 1 # Looping in breakable death-checking loops
@@ -58,21 +167,68 @@ class TildeAthInterp(object):
 
     def __init__(self):
         self.modules = {}
-        self.stack = []
+        self.stack = FrameStack()
         # Currently evaluating AST list.
         self.nodes = None
         # Current item in the AST list.
         self.ast = None
         # Current execution state.
         self.exec_state = 0
-        
+        # Number of function calls or loop iterations after which engines
+        # that can compile code do so, or None if they can't.
+        self.hot_threshold = None
+        # Calls and loop iterations so far, by function or loop body.
+        self.counters = {}
+
+    def count(self, body):
+        """Counts a call to a function or an iteration of a loop, and
+        returns whether it has run often enough to be compiled.
+        """
+        if self.hot_threshold is None:
+            return False
+        count = self.counters.get(id(body), 0) + 1
+        self.counters[id(body)] = count
+        return count > self.hot_threshold
+
+    def is_hot(self, body):
+        """Returns whether a function or loop has been compiled."""
+        if self.hot_threshold is None:
+            return False
+        return self.counters.get(id(body), 0) > self.hot_threshold
+
+    def deoptimize(self, func):
+        """Sends a function back to being interpreted."""
+        self.counters.pop(id(func.body), None)
+
+    def kill_frame(self, graves):
+        """Handles symbols killed while evaluating in the top frame."""
+        while True:
+            if 'THIS' in graves:
+                # End the program only when THIS is killed.
+                sys.exit(0)
+            if self.stack[-1].iter_nodes.pendant in graves:
+                # If the current frame's control variable is killed, evaluate:
+                state = self.stack[-1].exec_state
+                if state == self.TILALIVE_STATE:
+                    # If in keep-dead loop, force the loop to repeat.
+                    self.stack[-1].iter_nodes.reset()
+                else:
+                    # Otherwise, pop the execution stack and move on.
+                    self.stack.drop()
+                    self.ast = self.stack[-1].iter_nodes
+                    if state == self.FUNCEXEC_STATE:
+                        # If popping from a function, kill them again from here.
+                        for grave in graves:
+                            self.get_symbol(grave).kill()
+                        continue
+            self.stack[-1].eval_state.clear()
+            return
+
     def get_symbol(self, token):
         """Search the stack frames top first, then the builtins."""
-        for frame in reversed(self.stack):
-            try:
-                return frame.scope_vars[token]
-            except KeyError:
-                pass
+        values = self.stack.bindings.get(token)
+        if values is not None:
+            return values[-1]
         try:
             return ath_builtins[token]
         except KeyError as exc:
@@ -81,7 +237,7 @@ class TildeAthInterp(object):
     def set_symbol(self, token, value):
         """Attempt to add symbol to the top of the stack."""
         try:
-            self.stack[-1].scope_vars[token] = value
+            self.stack.bind(token, value)
         except IndexError:
             raise RuntimeError('All stack frames destroyed!!!!!')
 
@@ -91,16 +247,9 @@ class TildeAthInterp(object):
             # Top expression in a return statement is a function call
             return True
         if eval_len == 1 and self.stack[-1].exec_state == self.FUNCEXEC_STATE:
-            # The statement being evaluated in a function is another call
-            if self.ast.index >= len(self.ast.stmts):
-                # Execution points outside function body
-                return True
-            node = self.ast.get_current()
-            if node.name == 'CondiJump' and node.args[0] is None:
-                # Execution points to an unconditional jump
-                if self.ast.index + node.args[1] + 1 >= len(self.ast):
-                    # Jump points outside function body
-                    return True
+            # The statement being evaluated in a function is another call,
+            # after which only unconditional jumps lead out of the body.
+            return self.ast.index - 1 in self.ast.stmts.tail_positions()
         return False
 
     def eval_stmt(self, ret_value=None):
@@ -110,34 +259,30 @@ class TildeAthInterp(object):
         if ret_value is not None:
             node.set_argv(ret_value)
         while True:
-            try:
-                # Try to get the next argument AST node from the expression.
-                arg = node.get_arg()
-            except IndexError:
+            # Get how to evaluate the next argument of the expression.
+            opcode, operand = node.get_argop()
+            if opcode == ARG_LOOKUP:
+                # Name tokens that aren't passed as names evaluate their values.
+                node.set_argv(self.get_symbol(operand))
+            elif opcode == ARG_CONST:
+                # Names, literal values, functions and empty items are passed as is.
+                node.set_argv(operand)
+            elif opcode == ARG_EVAL:
+                # Evaluate expressions for their values before passing the result.
+                node = operand.prepare()
+                eval_state.append(node)
+            else:
                 # If there are no more left, execute the associated function.
+                if node.stmt.func is death_function:
+                    # Kill symbols without raising SymbolDeath from DIE.
+                    self.kill_frame(bury_symbols(self, *node.argv))
+                    return AthSymbol(False)
                 try:
                     ret_value = node.execute(self)
                 except SymbolDeath as exc:
-                    # In a DIE statement, SymbolDeath will be raised.
-                    if 'THIS' in exc.args[0]:
-                        # End the program only when THIS is killed.
-                        sys.exit(0)
-                    elif self.stack[-1].iter_nodes.pendant in exc.args[0]:
-                        # If the current frame's control variable is killed, evaluate:
-                        state = self.stack[-1].exec_state
-                        if state == self.TILALIVE_STATE:
-                            # If in keep-dead loop, force the loop to repeat.
-                            self.stack[-1].iter_nodes.reset()
-                        else:
-                            # Otherwise, pop the execution stack and move on.
-                            self.stack.pop()
-                            self.ast = self.stack[-1].iter_nodes
-                            if state == self.FUNCEXEC_STATE:
-                                # If popping from a function, evaluate from here instead.
-                                eval_state = self.stack[-1].eval_state
-                                ret_val = AthSymbol(False)
-                                continue
-                    eval_state.clear()
+                    # Deaths from anywhere else, such as builtins called
+                    # through EXECUTE, still arrive as SymbolDeath.
+                    self.kill_frame(exc.args[0])
                     return AthSymbol(False)
                 except Exception as exc:
                     # When other errors occur, pass the exception upward.
@@ -151,18 +296,28 @@ class TildeAthInterp(object):
                             node = eval_state[-1]
                             node.set_argv(func(self, *scope_vars))
                             continue
-                        if self.is_tail_call(len(eval_state) + 1):
+                        is_tail_call = self.is_tail_call(len(eval_state) + 1)
+                        if not is_tail_call and self.count(func.body):
+                            # Run hot functions compiled, returning here.
+                            try:
+                                ret_value = self.call_function(func, scope_vars)
+                            except SymbolDeath as exc:
+                                # The function was killed, and killed again here.
+                                self.kill_frame(exc.args[0])
+                                return AthSymbol(False)
+                            if not eval_state:
+                                return None
+                            node = eval_state[-1]
+                            node.set_argv(ret_value)
+                            continue
+                        if is_tail_call:
                             frame = self.stack[-1]
-                            frame.scope_vars = scope_vars
-                            frame.iter_nodes = func.body.iter_nodes()
+                            self.stack.replace_scope(scope_vars)
+                            frame.iter_nodes.restart(func.body)
                             frame.exec_state = self.FUNCEXEC_STATE
                             eval_state.clear()
                         else:
-                            self.stack.append(AthStackFrame(
-                                scope_vars=scope_vars,
-                                iter_nodes=func.body.iter_nodes(),
-                                exec_state=self.FUNCEXEC_STATE,
-                                ))
+                            self.stack.push(func.body, self.FUNCEXEC_STATE, scope_vars)
                         self.ast = self.stack[-1].iter_nodes
                         return None
                     if len(eval_state) > 1:
@@ -173,24 +328,6 @@ class TildeAthInterp(object):
                     # If this is the last expression in the stack, return to the AST.
                     eval_state.clear()
                     return ret_value
-            else:
-                # If there is an argument left to evaluate, deal with it first.
-                if arg is None or isinstance(arg, (int, str, AthCustomFunction)):
-                    # Name, Number, Function, and Empty items are passed as is.
-                    node.set_argv(arg)
-                elif isinstance(arg, LiteralToken):
-                    # Tokens pass their values.
-                    node.set_argv(arg.value)
-                elif isinstance(arg, IdentifierToken):
-                    # Name tokens pass either their names or evaluate their values.
-                    if node.is_name_arg():
-                        node.set_argv(arg.name)
-                    else:
-                        node.set_argv(self.get_symbol(arg.name))
-                elif isinstance(arg, AthStatement):
-                    # Evaluate expressions for their values before passing the result.
-                    node = arg.prepare()
-                    eval_state.append(node)
 
     def eval_return(self, ret_value):
         while True:
@@ -203,7 +340,7 @@ class TildeAthInterp(object):
                 and frame.get_current().name == 'DIVULGATE'
                 ):
                 return
-            self.stack.pop()
+            self.stack.drop()
 
     def exec_stmts(self, fname, stmts):
         # AST Execution trampoline.
@@ -211,12 +348,11 @@ class TildeAthInterp(object):
         while True:
             try:
                 ath_builtins['THIS'] = ThisSymbol(fname, stmts)
-                self.stack.append(AthStackFrame(iter_nodes=stmts.iter_nodes()))
+                self.stack.push(stmts, self.TOPLEVEL_STATE)
                 self.ast = self.stack[-1].iter_nodes
                 while True:
-                    try:
-                        node = next(self.ast)
-                    except StopIteration:
+                    node = self.ast.next_stmt()
+                    if node is None:
                         state = self.stack[-1].exec_state
                         if state == self.TOPLEVEL_STATE:
                             sys.exit(0) # override
@@ -228,34 +364,45 @@ class TildeAthInterp(object):
                             else:
                                 self.ast.reset()
                         elif state == self.FUNCEXEC_STATE:
-                            self.stack.pop()
+                            self.stack.drop()
                             self.eval_return(AthSymbol(False))
                             self.ast = self.stack[-1].iter_nodes
                         else:
                             if (self.get_symbol(self.ast.pendant).alive
                                 == bool(state - self.TILDEATH_STATE)
                                 ):
-                                self.stack.pop()
+                                self.stack.drop()
+                                self.ast = self.stack[-1].iter_nodes
+                            elif self.count(self.ast.stmts):
+                                # Run the rest of hot loops compiled.
+                                self.ast.reset()
+                                self.tier_up_loop(
+                                    self.stack[-1], bool(state - self.TILDEATH_STATE),
+                                    self.ast.stmts,
+                                    )
                                 self.ast = self.stack[-1].iter_nodes
                             else:
                                 self.ast.reset()
                         continue
                     # print(repr(node))
                     if isinstance(node, TildeAthLoop):
+                        if self.is_hot(node.body):
+                            self.run_loop(node.state, node.body)
+                            self.ast = self.stack[-1].iter_nodes
+                            continue
                         if self.get_symbol(node.body.pendant).alive == node.state:
                             continue
-                        self.stack.append(AthStackFrame(
-                            iter_nodes=node.body.iter_nodes(),
-                            exec_state=self.TILDEATH_STATE + int(node.state),
-                            ))
+                        self.stack.push(node.body, self.TILDEATH_STATE + int(node.state))
                         self.ast = self.stack[-1].iter_nodes
                         continue
+                    if isinstance(node, NativeStatement) and node.dispatch(self):
+                        continue
                     self.stack[-1].eval_state.append(node.prepare())
                     ret_value = self.eval_stmt()
                     if (self.stack[-1].get_current().name == 'DIVULGATE'
                         and ret_value is not None
                         ):
-                        self.stack.pop()
+                        self.stack.drop()
                         self.eval_return(ret_value)
             except KeyboardInterrupt:
                 raise # override
@@ -295,7 +442,7 @@ class TildeAthInterp(object):
             with open(os.path.join('script', fname), 'r') as script_file:
                 ast = ath_parser(script_file.read())
         self.write_ast(fname, ast)
-        self.exec_stmts(fname, ast)
+        self.exec_stmts(fname, optimize(ast))
 
 
 if __name__ == '__main__':
@@ -312,8 +459,30 @@ if __name__ == '__main__':
         action='store_true',
         help='parse directly from the script',
         )
+    cmdparser.add_argument(
+        '-s', '--stats',
+        action='store_true',
+        help='print how often each fused statement pattern ran on exit',
+        )
+    cmdparser.add_argument(
+        '-e', '--engine',
+        choices=engines,
+        default='trampoline',
+        help='execution engine to run the script with',
+        )
+    cmdparser.add_argument(
+        '-t', '--threshold',
+        type=int,
+        help='calls or loop iterations before the tiered engine compiles code',
+        )
     cmdargs = cmdparser.parse_args()
-    ath_interp = TildeAthInterp()
+    if cmdargs.engine == 'trampoline':
+        ath_interp = TildeAthInterp()
+    else:
+        module, engine = engines[cmdargs.engine]
+        ath_interp = getattr(__import__(module), engine)()
+    if cmdargs.threshold is not None and ath_interp.hot_threshold is not None:
+        ath_interp.hot_threshold = cmdargs.threshold
     if cmdargs.athfname == 'all':
         ath_interp.write_all()
     else:
@@ -323,3 +492,9 @@ if __name__ == '__main__':
             raise IOError(
                 f'File {cmdargs.athfname} not found in script directory'
                 )
+        finally:
+            if cmdargs.stats:
+                for pattern in fusion_table.patterns:
+                    sys.stderr.write(
+                        f'{pattern}: {fusion_table.hits[pattern]} hits\n'
+                        )
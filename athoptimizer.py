@@ -0,0 +1,547 @@
+"""Load-time passes that rewrite a parsed ~ATH AST into faster equivalents.
+
+Every pass works in place on flattened statement lists, and never changes
+their length, so the relative offsets of conditional jumps stay valid.
+"""
+import operator
+from collections import Counter
+from athsymbol import (
+    isAthValue, vector_types, vector_test,
+    AthSymbol, BuiltinSymbol, AthBuiltinFunction,
+    )
+from athstmt import (
+    biops, unops, arith_biops, biopr_expression,
+    is_arith, is_simple_arith,
+    LiteralToken, IdentifierToken,
+    AthStatement, AthTokenStatement, TildeAthLoop,
+    BnaryExpr, CondiJump, ArithExpr,
+    NativeStatement, SwitchJump, FusedStatement,
+    )
+from athbuiltins_default import bifurcate_statement, aggregate_statement, CallSite
+
+# Chains testing fewer distinct constants than this are left alone.
+SWITCH_MIN_CASES = 3
+
+
+def iter_stmtlists(stmts):
+    """Yields a statement list and every statement list nested inside it."""
+    stack = [stmts]
+    while stack:
+        stmtlist = stack.pop()
+        yield stmtlist
+        for stmt in stmtlist:
+            if isinstance(stmt, TildeAthLoop):
+                stack.append(stmt.body)
+            elif isinstance(stmt, AthTokenStatement) and stmt.name == 'FABRICATE':
+                stack.append(stmt.args[0].body)
+
+
+def equality_test(expr):
+    """Returns the (name, constant) pair of an expression of the form
+    NAME == CONSTANT or CONSTANT == NAME, otherwise None.
+    """
+    if not isinstance(expr, BnaryExpr) or expr.args[0] != '==':
+        return None
+    _, lft, rht = expr.args
+    if isinstance(lft, LiteralToken):
+        lft, rht = rht, lft
+    if isinstance(lft, IdentifierToken) and isinstance(rht, LiteralToken):
+        return lft.name, rht.value
+    return None
+
+
+def follow_jumps(stmts, index):
+    """Returns where execution ends up after any unconditional jumps."""
+    while index < len(stmts):
+        stmt = stmts[index]
+        if type(stmt) is not CondiJump or stmt.args[0] is not None:
+            break
+        index += stmt.args[1] + 1
+    return index
+
+
+def debate_test(stmt):
+    """Matches the conditional jumps created from DEBATE and UNLESS clauses."""
+    if type(stmt) is CondiJump and stmt.args[0] is not None:
+        return equality_test(stmt.args[0])
+    return None
+
+
+def lower_debates(stmts):
+    """Replaces the head of each DEBATE/UNLESS chain testing one symbol
+    against constants with a SwitchJump.
+
+    The chain is found by following the jumps taken when each test fails,
+    so the lookup table sends every constant to the body its test guards,
+    and anything else to wherever the last failing test would go.
+    """
+    consumed = set()
+    for head, stmt in enumerate(stmts):
+        test = debate_test(stmt)
+        if test is None or head in consumed:
+            continue
+        subject = test[0]
+        tests = []
+        index = head
+        while test is not None and test[0] == subject:
+            tests.append((index, test[1]))
+            index = follow_jumps(stmts, index + stmts[index].args[1] + 1)
+            test = debate_test(stmts[index]) if index < len(stmts) else None
+        if len({value for _, value in tests}) < SWITCH_MIN_CASES:
+            continue
+        cases = {}
+        for test, value in tests:
+            cases.setdefault(value, test - head)
+            consumed.add(test)
+        stmts[head] = SwitchJump(stmt, subject, cases, index - head - 1)
+
+
+def replicate_test(stmts, index):
+    """Matches REPLICATE GRAVE NAME == CONSTANT; followed by ~ATH(GRAVE),
+    returning the (grave, name, constant) triple of the pair.
+    """
+    if index + 1 >= len(stmts):
+        return None
+    stmt, loop = stmts[index], stmts[index + 1]
+    if not (type(stmt) is AthTokenStatement
+        and stmt.name == 'REPLICATE'
+        and isinstance(loop, TildeAthLoop)
+        and not loop.state
+        ):
+        return None
+    grave = stmt.args[0].name
+    test = equality_test(stmt.args[1])
+    if test is None or loop.body.pendant != grave or test[0] == grave:
+        return None
+    return (grave, *test)
+
+
+def lower_replicates(stmts):
+    """Replaces chains of REPLICATE GRAVE NAME == CONSTANT; ~ATH(GRAVE){...}
+    pairs with SwitchJumps.
+
+    A pair whose test fails only leaves a dead GRAVE behind, which the next
+    pair overwrites, so each pair may skip directly to the pair matching
+    NAME, or to the last pair of the chain if none do. The matching pair
+    itself runs as normal, and the check is repeated after its loop body,
+    in case the body changed NAME.
+    """
+    index = 0
+    while index < len(stmts):
+        test = replicate_test(stmts, index)
+        if test is None:
+            index += 1
+            continue
+        chain = [(index, test)]
+        index += 2
+        test = replicate_test(stmts, index)
+        while test is not None and test[:2] == chain[0][1][:2]:
+            chain.append((index, test))
+            index += 2
+            test = replicate_test(stmts, index)
+        if len({value for _, (_, _, value) in chain}) < SWITCH_MIN_CASES:
+            continue
+        last = chain[-1][0]
+        for link, (head, (_, subject, own)) in enumerate(chain[:-1]):
+            cases = {}
+            for pair, (_, _, value) in reversed(chain[link:]):
+                cases[value] = pair - head - 1
+            cases[own] = None
+            stmts[head] = SwitchJump(stmts[head], subject, cases, last - head - 1)
+
+
+class FusionTable(object):
+    """Pluggable table of adjacent statement sequences to fuse together.
+
+    Each pattern has a name, the number of statements it spans, and a
+    matcher taking that many statements. The matcher returns None if they
+    don't fit the pattern, otherwise the native function that runs them,
+    which takes the interpreter and returns False if it can't handle the
+    current state. Hits are counted per pattern every time one runs.
+    """
+    __slots__ = ('patterns', 'hits')
+
+    def __init__(self):
+        self.patterns = {}
+        self.hits = Counter()
+
+    def register(self, name, length):
+        """Decorator adding a matcher to the table."""
+        def add_pattern(matcher):
+            self.patterns[name] = (length, matcher)
+            return matcher
+        return add_pattern
+
+    def match(self, stmts, index):
+        """Returns a FusedStatement for the first pattern matching the
+        statements starting at index, otherwise None.
+        """
+        for name, (length, matcher) in self.patterns.items():
+            window = stmts[index:index + length]
+            if len(window) < length:
+                continue
+            runner = matcher(*window)
+            if runner is not None:
+                return FusedStatement(window, name, runner, self)
+        return None
+
+fusion_table = FusionTable()
+
+
+def is_token_stmt(stmt, name):
+    return type(stmt) is AthTokenStatement and stmt.name == name
+
+
+def operand_getter(token):
+    """Returns a function fetching an identifier or literal's value."""
+    if isinstance(token, IdentifierToken):
+        name = token.name
+        return lambda env: env.get_symbol(name)
+    if isinstance(token, LiteralToken):
+        value = token.value
+        return lambda env: value
+    return None
+
+
+@fusion_table.register('split_merge', 2)
+def match_split_merge(bfct, aggr):
+    """BIFURCATE SRC[LFT, RHT]; AGGREGATE [NAME, NAME]DST;
+
+    Covers the list reversal idiom BIFURCATE X[H, X]; AGGREGATE [H, Y]Y;
+    """
+    if not (is_token_stmt(bfct, 'BIFURCATE')
+        and is_token_stmt(aggr, 'AGGREGATE')
+        and len(bfct.args) == len(aggr.args) == 3
+        and all(isinstance(arg, IdentifierToken) for arg in aggr.args)
+        ):
+        return None
+    src, lft, rht = (arg.name for arg in bfct.args)
+    dst, head, tail = (arg.name for arg in aggr.args)
+    def run_split_merge(env):
+        bifurcate_statement(env, src, lft, rht)
+        aggregate_statement(env, dst, env.get_symbol(head), env.get_symbol(tail))
+        return True
+    return run_split_merge
+
+
+compare_ops = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '~=': operator.ne,
+    }
+
+@fusion_table.register('count_check', 2)
+def match_count_check(procr, jump):
+    """PROCREATE NAME (NAME + NUMBER); DEBATE(LFT <cmp> RHT){...}
+
+    Subtraction of a number works too, and both sides of the comparison
+    must be identifiers or literals.
+    """
+    if not (is_token_stmt(procr, 'PROCREATE')
+        and type(jump) is CondiJump
+        and isinstance(procr.args[1], BnaryExpr)
+        and isinstance(jump.args[0], BnaryExpr)
+        ):
+        return None
+    name = procr.args[0].name
+    opr, counter, step = procr.args[1].args
+    if not (opr in ('+', '-')
+        and isinstance(counter, IdentifierToken)
+        and counter.name == name
+        and isinstance(step, LiteralToken)
+        and type(step.value) in (int, float)
+        ):
+        return None
+    delta = step.value if opr == '+' else -step.value
+    cmp, lft, rht = jump.args[0].args
+    get_lft, get_rht = operand_getter(lft), operand_getter(rht)
+    if cmp not in compare_ops or get_lft is None or get_rht is None:
+        return None
+    compare = compare_ops[cmp]
+    jlen = jump.args[1]
+    def run_count_check(env):
+        sym = env.get_symbol(name)
+        value = sym.left
+        if type(value) not in (int, float) or isinstance(sym, BuiltinSymbol):
+            return False
+        sym.unshare()
+        sym.left = value + delta
+        lval, rval = get_lft(env), get_rht(env)
+        if isinstance(lval, AthSymbol) and isAthValue(lval.left):
+            # Comparisons against a symbol's value live or die by the result.
+            alive = compare(
+                lval.left, rval.left if isinstance(rval, AthSymbol) else rval
+                )
+            if type(alive) in vector_types:
+                alive = vector_test(alive)
+        else:
+            alive = biopr_expression(env, cmp, lval, rval)
+        if not alive:
+            env.stack[-1].iter_nodes.index += jlen
+        return True
+    return run_count_check
+
+
+def fuse_statements(stmts):
+    """Replaces runs of statements matching the fusion table's patterns
+    with FusedStatements.
+    """
+    index = 0
+    while index < len(stmts):
+        fused = fusion_table.match(stmts, index)
+        if fused is None:
+            index += 1
+        else:
+            stmts[index] = fused
+            index += len(fused.stmts)
+
+
+def is_unboxed_arg(stmt, index):
+    """True if a statement only ever takes the left value of the
+    symbol passed as its argument at index.
+    """
+    if stmt.name == 'PROCREATE':
+        return index == 1
+    if stmt.name == 'print':
+        return index > 0
+    return False
+
+
+def compile_expr(expr, unboxed=False):
+    """Returns an expression with its arithmetic trees compiled."""
+    if is_arith(expr) and is_simple_arith(expr):
+        return ArithExpr(expr, unboxed)
+    if isinstance(expr, AthStatement):
+        compile_args(expr)
+    return expr
+
+
+def compile_args(stmt):
+    args = [
+        compile_expr(arg, is_unboxed_arg(stmt, index))
+        for index, arg in enumerate(stmt.args)
+        ]
+    if isinstance(stmt.args, list):
+        stmt.args[:] = args
+    else:
+        stmt.args = type(stmt.args)(args)
+
+
+def unbox_arithmetic(stmts):
+    """Compiles every arithmetic expression tree with only names and
+    literals for leaves into an ArithExpr.
+    """
+    for stmt in stmts:
+        if isinstance(stmt, NativeStatement):
+            compile_args(stmt.fallback)
+            stmt.args = stmt.fallback.args
+        elif not isinstance(stmt, TildeAthLoop):
+            compile_args(stmt)
+
+
+class QuickFunction(AthBuiltinFunction):
+    """Stands in for the function of a node that specialises itself.
+
+    The first call runs the generic function, then gives the node the
+    function its specialiser returns for the arguments it just saw. That
+    function has to check its arguments are still of the same kinds, and
+    call the generic function instead if they aren't. If the specialiser
+    returns None, the node gets its generic function back.
+    """
+    __slots__ = ('node', 'generic', 'specialise')
+
+    def __init__(self, node, specialise):
+        generic = node.func
+        super().__init__(generic.name, generic.func, generic.bitmask)
+        self.node = node
+        self.generic = generic
+        self.specialise = specialise
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, {self.specialise.__name__})'
+
+    def __call__(self, env, *args):
+        ans = self.func(env, *args)
+        fast = self.specialise(self.func, *args)
+        if fast is None:
+            self.node.func = self.generic
+        else:
+            self.node.func = AthBuiltinFunction(self.name, fast, self.bitmask)
+        return ans
+
+# Specialisers by the name of the statement they quicken.
+specialisers = {}
+
+def specialiser(name):
+    """Decorator adding a specialiser to the table."""
+    def add_specialiser(specialise):
+        specialisers[name] = specialise
+        return specialise
+    return add_specialiser
+
+
+number_types = (int, float)
+
+def is_number_symbol(value):
+    return type(value) is AthSymbol and type(value.left) in number_types
+
+def is_number(value):
+    return type(value) in number_types
+
+@specialiser('BnaryExpr')
+def specialise_binary(generic, opr, lft, rht):
+    """Arithmetic or comparison on numbers and symbols holding numbers.
+
+    Each pair of operand kinds builds the same symbol that the symbol
+    operators would for it, without looking up the operator by name or
+    going through the symbol's operator methods.
+    """
+    if opr not in compare_ops and opr not in arith_biops:
+        return None
+    lsym, rsym = is_number_symbol(lft), is_number_symbol(rht)
+    is_lft = is_number_symbol if lsym else is_number
+    is_rht = is_number_symbol if rsym else is_number
+    if not (is_lft(lft) and is_rht(rht)):
+        return None
+    op = biops[opr]
+    if opr in compare_ops:
+        if lsym and rsym:
+            build = lambda lft, rht: AthSymbol(op(lft.left, rht.left))
+        elif lsym:
+            build = lambda lft, rht: AthSymbol(op(lft.left, rht), lft.left, lft.right)
+        elif rsym:
+            build = lambda lft, rht: AthSymbol(op(lft, rht.left), rht.left, rht.right)
+        else:
+            build = lambda lft, rht: AthSymbol(left=op(lft, rht))
+    else:
+        if lsym and rsym:
+            build = lambda lft, rht: AthSymbol(left=op(lft.left, rht.left))
+        elif lsym:
+            build = lambda lft, rht: AthSymbol(left=op(lft.left, rht), right=lft.right)
+        elif rsym:
+            build = lambda lft, rht: AthSymbol(left=op(lft, rht.left), right=rht.right)
+        else:
+            build = lambda lft, rht: AthSymbol(left=op(lft, rht))
+    def quick_binary(env, opr, lft, rht):
+        if is_lft(lft) and is_rht(rht):
+            return build(lft, rht)
+        return generic(env, opr, lft, rht)
+    return quick_binary
+
+
+@specialiser('UnaryExpr')
+def specialise_unary(generic, opr, val):
+    """Logical negation of symbols, and arithmetic on symbols holding numbers."""
+    op = unops[opr]
+    if opr == '!':
+        if type(val) is not AthSymbol:
+            return None
+        def quick_not(env, opr, val):
+            if type(val) is AthSymbol:
+                return AthSymbol(not val.alive, val.left, val.right)
+            return generic(env, opr, val)
+        return quick_not
+    if not is_number_symbol(val):
+        return None
+    def quick_unary(env, opr, val):
+        if is_number_symbol(val):
+            return AthSymbol(left=op(val.left))
+        return generic(env, opr, val)
+    return quick_unary
+
+
+@specialiser('PROCREATE')
+def specialise_procreate(generic, dst, src=None):
+    """Assignment of a literal, or of a plain symbol's left value,
+    to a name already bound to a plain symbol.
+    """
+    if type(dst) is not str:
+        return None
+    if type(src) in (int, float, str):
+        def quick_procreate(env, dst, src=None):
+            if type(src) in (int, float, str):
+                try:
+                    sym = env.get_symbol(dst)
+                except NameError:
+                    pass
+                else:
+                    if type(sym) is AthSymbol:
+                        sym.unshare()
+                        sym.left = src
+                        return sym
+            return generic(env, dst, src)
+        return quick_procreate
+    if type(src) is AthSymbol:
+        def quick_procreate(env, dst, src=None):
+            if type(src) is AthSymbol:
+                try:
+                    sym = env.get_symbol(dst)
+                except NameError:
+                    pass
+                else:
+                    if type(sym) is AthSymbol:
+                        sym.unshare()
+                        sym.left = src.left
+                        return sym
+            return generic(env, dst, src)
+        return quick_procreate
+    return None
+
+
+def arm_quickening(stmt):
+    """Gives a statement and the expressions in its arguments functions
+    that quicken them on their first run.
+    """
+    name = stmt.fallback.name if isinstance(stmt, NativeStatement) else stmt.name
+    if name in specialisers and not isinstance(stmt.func, QuickFunction):
+        stmt.func = QuickFunction(stmt, specialisers[name])
+    for arg in stmt.args:
+        if isinstance(arg, AthStatement):
+            arm_quickening(arg)
+
+
+def quicken_statements(stmts):
+    """Arms every statement for quickening."""
+    for stmt in stmts:
+        if not isinstance(stmt, TildeAthLoop):
+            arm_quickening(stmt)
+
+
+def arm_call_site(stmt):
+    """Gives every EXECUTE statement in a statement and its arguments
+    its own call site cache.
+    """
+    name = stmt.fallback.name if isinstance(stmt, NativeStatement) else stmt.name
+    if name == 'EXECUTE' and not isinstance(stmt.func, CallSite):
+        stmt.func = CallSite()
+    for arg in stmt.args:
+        if isinstance(arg, AthStatement):
+            arm_call_site(arg)
+
+
+def cache_call_sites(stmts):
+    """Arms every EXECUTE statement with a call site cache."""
+    for stmt in stmts:
+        if not isinstance(stmt, TildeAthLoop):
+            arm_call_site(stmt)
+
+
+ast_passes = [
+    lower_debates,
+    lower_replicates,
+    fuse_statements,
+    unbox_arithmetic,
+    quicken_statements,
+    cache_call_sites,
+    ]
+
+
+def optimize(stmts):
+    """Runs every pass over a parsed script and returns it."""
+    for stmtlist in iter_stmtlists(stmts):
+        for ast_pass in ast_passes:
+            ast_pass(stmtlist)
+    return stmts
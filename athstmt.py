@@ -1,7 +1,7 @@
 import operator
 from functools import partial
 from athsymbol import (
-    isAthValue, AthExpr, AthSymbol,
+    isAthValue, concat, vector_types, AthExpr, AthSymbol,
     BuiltinSymbol, AthBuiltinFunction, AthCustomFunction,
     SymbolError,
     )
@@ -64,7 +64,7 @@ biops = {
     '/': operator.truediv,
     '/_': operator.floordiv,
     '%': operator.mod,
-    '+': operator.add,
+    '+': concat,
     '-': operator.sub,
     '<<': operator.lshift,
     '>>': operator.rshift,
@@ -100,6 +100,91 @@ def biopr_expression(env, opr, lft, rht):
         return AthSymbol(left=ans)
     return ans
 
+# Operators whose results are plain values when given plain values.
+arith_unops = frozenset(('+', '-', '~'))
+arith_biops = frozenset((
+    '^', '*', '/', '/_', '%', '+', '-', '<<', '>>', 'b&', 'b|', 'b^',
+    ))
+
+def is_arith(expr):
+    """True if an expression node is an arithmetic operation."""
+    if type(expr) is BnaryExpr:
+        return expr.args[0] in arith_biops
+    if type(expr) is UnaryExpr:
+        return expr.args[0] in arith_unops
+    return False
+
+def is_simple_arith(expr):
+    """True if an arithmetic expression tree only has names and
+    literals for leaves, so it can be compiled to an ArithExpr.
+    """
+    if isinstance(expr, (IdentifierToken, LiteralToken)):
+        return True
+    if not is_arith(expr):
+        return False
+    if type(expr) is UnaryExpr:
+        return is_simple_arith(expr.args[1])
+    opr, lft, rht = expr.args
+    if (opr == '%'
+        and isinstance(lft, LiteralToken)
+        and isinstance(lft.value, str)
+        and not isinstance(rht, LiteralToken)
+        ):
+        # String formatting would swallow the symbol on the right.
+        return False
+    return is_simple_arith(lft) and is_simple_arith(rht)
+
+def check_value(value):
+    """Raises the error symbol operators raise on non-value lefts."""
+    if not isAthValue(value):
+        raise SymbolError('symbol left is not a value')
+    return value
+
+def compile_arith(expr, leaves):
+    """Compiles an arithmetic expression tree into a function computing
+    its plain value from the values of its leaves, appending each leaf
+    to the leaves list in evaluation order.
+
+    Returns the function, whether the node's result would have been a
+    symbol, and the index of the name leaf whose right value that symbol
+    would have carried, if any. Names evaluate to symbols, literals to
+    plain values, and every operation to a symbol, and each operation
+    behaves as the symbol operator it replaces would.
+    """
+    if isinstance(expr, LiteralToken):
+        index = len(leaves)
+        leaves.append(expr)
+        return (lambda vals: vals[index]), False, None
+    if isinstance(expr, IdentifierToken):
+        index = len(leaves)
+        leaves.append(expr)
+        return (lambda vals: vals[index].left), True, index
+    if type(expr) is UnaryExpr:
+        opr, arg = expr.args
+        op = unops[opr]
+        get, is_sym, _ = compile_arith(arg, leaves)
+        if is_sym:
+            return (lambda vals: op(check_value(get(vals)))), True, None
+        return (lambda vals: op(get(vals))), True, None
+    opr, lft, rht = expr.args
+    op = biops[opr]
+    get_lft, lft_sym, lft_carry = compile_arith(lft, leaves)
+    get_rht, rht_sym, rht_carry = compile_arith(rht, leaves)
+    if lft_sym:
+        # Symbol on the left: keeps its right value if the other is plain.
+        carry = None if rht_sym else lft_carry
+        return (
+            (lambda vals: op(check_value(get_lft(vals)), get_rht(vals))),
+            True, carry,
+            )
+    if rht_sym:
+        # Plain value on the left: defers to the symbol's reverse operator.
+        return (
+            (lambda vals: op(get_lft(vals), check_value(get_rht(vals)))),
+            True, rht_carry,
+            )
+    return (lambda vals: op(get_lft(vals), get_rht(vals))), True, None
+
 def on_dead_jump(env, expr, jlen):
     if not expr:
         env.stack[-1].iter_nodes.index += jlen
@@ -113,6 +198,7 @@ class ThisSymbol(BuiltinSymbol):
         self.alive = True
         self.left = fname
         self.right = AthCustomFunction(fname[:-5], [], ast)
+        self.share = 0
 
 
 class BaseToken(AthExpr):
@@ -165,12 +251,8 @@ class AthExecutor(object):
     def is_ready(self):
         return len(self.argv) == len(self.stmt.args)
 
-    def is_name_arg(self):
-        bitmask = self.stmt.func.bitmask
-        return bitmask < 0 or bitmask & (1 << len(self.argv))
-
-    def get_arg(self):
-        return self.stmt.args[len(self.argv)]
+    def get_argop(self):
+        return self.stmt.evalops[len(self.argv)]
 
     def get_args(self):
         self.argv.clear()
@@ -186,14 +268,23 @@ class AthExecutor(object):
         return self.stmt.func(env, *self.argv)
 
 
+# Argument opcodes, telling the evaluator how to get an argument's value.
+ARG_CONST = 0 # Passed as is: names, literal values, functions, jump lengths
+ARG_LOOKUP = 1 # The symbol bound to a name
+ARG_EVAL = 2 # The result of evaluating an expression
+ARG_DONE = 3 # No arguments are left, so the statement can run
+
+
 class AthStatement(AthExpr):
     """TBD"""
-    __slots__ = ('args', 'name', 'func')
+    __slots__ = ('args', 'name', 'func', 'argops', 'evalops')
 
     def __init__(self, args, name, func):
         self.args = args
         self.name = name
         self.func = func
+        self.argops = None
+        self.evalops = None
 
     def __str__(self):
         return f'<{self.name} statement>'
@@ -201,7 +292,35 @@ class AthStatement(AthExpr):
     def __repr__(self):
         return f'{self.__class__.__name__}({self.args})'
 
+    def classify(self):
+        """Works out the (opcode, operand) pair the evaluator uses to get
+        the value of each argument, so it doesn't have to inspect them
+        every time this statement runs.
+
+        Statements are classified on their first run, after every load-time
+        pass has rewritten their arguments.
+        """
+        bitmask = self.func.bitmask
+        argops = []
+        for index, arg in enumerate(self.args):
+            if isinstance(arg, LiteralToken):
+                argops.append((ARG_CONST, arg.value))
+            elif isinstance(arg, IdentifierToken):
+                if bitmask < 0 or bitmask & (1 << index):
+                    argops.append((ARG_CONST, arg.name))
+                else:
+                    argops.append((ARG_LOOKUP, arg.name))
+            elif isinstance(arg, AthStatement):
+                argops.append((ARG_EVAL, arg))
+            else:
+                argops.append((ARG_CONST, arg))
+        self.argops = tuple(argops)
+        # The evaluator reads past the last argument to find it is done.
+        self.evalops = self.argops + ((ARG_DONE, None),)
+
     def prepare(self):
+        if self.argops is None:
+            self.classify()
         return AthExecutor(self)
 
 
@@ -213,6 +332,8 @@ class AthTokenStatement(AthStatement):
         self.name = name
         self.args = args
         self.func = ath_builtins[name].right
+        self.argops = None
+        self.evalops = None
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.name!r}, {self.args!r})'
@@ -273,6 +394,131 @@ class CondiJump(AthStatement):
             )
 
 
+class NativeStatement(AthStatement):
+    """Base class of optimized statements that stand in for one or more
+    statements at the head of a statement list slice.
+
+    They run directly against the interpreter instead of going through
+    the evaluation trampoline through their dispatch method, which returns
+    True if the statement ran. Whenever they can't handle the current
+    state, it returns False and the first statement they replaced is
+    evaluated as normal.
+    """
+    __slots__ = ('fallback',)
+
+    def __init__(self, fallback):
+        super().__init__(fallback.args, self.__class__.__name__, fallback.func)
+        self.fallback = fallback
+
+
+class ArithExpr(AthStatement):
+    """An arithmetic expression tree compiled into a single expression.
+
+    Its leaves are its only arguments, and every intermediate result stays
+    a plain value instead of being boxed into a symbol. The result itself
+    is boxed the same way the tree would have boxed it, unless unboxed is
+    set, which is for consumers that only ever take a symbol's left value.
+    """
+    __slots__ = ('expr', 'unboxed')
+
+    def __init__(self, expr, unboxed=False):
+        leaves = []
+        get, _, carry = compile_arith(expr, leaves)
+        if carry is None:
+            def box(value, vals):
+                return AthSymbol(left=value)
+        else:
+            def box(value, vals):
+                return AthSymbol(left=value, right=vals[carry].right)
+        if unboxed:
+            def arith_expression(env, *vals):
+                value = get(vals)
+                if isAthValue(value):
+                    return value
+                return box(value, vals)
+        else:
+            def arith_expression(env, *vals):
+                return box(get(vals), vals)
+        super().__init__(
+            leaves,
+            self.__class__.__name__,
+            AthBuiltinFunction(self.__class__.__name__, arith_expression, 0),
+            )
+        self.expr = expr
+        self.unboxed = unboxed
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.expr!r}, {self.unboxed!r})'
+
+
+class SwitchJump(NativeStatement):
+    """Stands in for a statement heading a chain of equality tests that
+    all compare the same symbol against constants.
+
+    The cases table maps each constant to the jump offset that the
+    chain of tests would end up taking. If the symbol's left value is
+    not a plain value, or the table yields None, the statement it
+    replaced is evaluated as normal instead.
+    """
+    __slots__ = ('subject', 'cases', 'default')
+
+    def __init__(self, fallback, subject, cases, default):
+        super().__init__(fallback)
+        self.subject = subject
+        self.cases = cases
+        self.default = default
+
+    def __repr__(self):
+        return '{}({!r}, {!r}, {!r}, {!r})'.format(
+            self.__class__.__name__,
+            self.fallback,
+            self.subject,
+            self.cases,
+            self.default,
+            )
+
+    def dispatch(self, env):
+        """Jumps straight to the selected case and returns True,
+        or returns False if the fallback has to be evaluated.
+        """
+        value = env.get_symbol(self.subject).left
+        if not isAthValue(value) or type(value) in vector_types:
+            return False
+        offset = self.cases.get(value, self.default)
+        if offset is None:
+            return False
+        env.stack[-1].iter_nodes.index += offset
+        return True
+
+
+class FusedStatement(NativeStatement):
+    """Stands in for a run of adjacent statements matched by a fusion
+    pattern, executing all of them with one native function.
+
+    The native function returns False without side effects if it can't
+    handle the current state. The replaced statements stay in place after
+    this one, so jumps into the middle of the run still work.
+    """
+    __slots__ = ('stmts', 'pattern', 'runner', 'table')
+
+    def __init__(self, stmts, pattern, runner, table):
+        super().__init__(stmts[0])
+        self.stmts = stmts
+        self.pattern = pattern
+        self.runner = runner
+        self.table = table
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.pattern!r}, {self.stmts!r})'
+
+    def dispatch(self, env):
+        if not self.runner(env):
+            return False
+        self.table.hits[self.pattern] += 1
+        env.stack[-1].iter_nodes.index += len(self.stmts) - 1
+        return True
+
+
 class AthStatementIter(object):
     __slots__ = ('stmts', 'index', 'pendant')
 
@@ -299,12 +545,26 @@ class AthStatementIter(object):
         self.index += 1
         return stmt
 
+    def next_stmt(self):
+        """Returns the next statement, or None at the end of the list."""
+        index = self.index
+        if index < len(self.stmts):
+            self.index = index + 1
+            return self.stmts[index]
+        return None
+
     def get_current(self):
         return self.stmts[self.index - 1 if self.index > 0 else 0]
 
     def reset(self):
         self.index = 0
 
+    def restart(self, stmts):
+        """Points the iterator at the start of another statement list."""
+        self.stmts = stmts
+        self.pendant = stmts.pendant
+        self.index = 0
+
 
 class StmtPrintFrame(object):
     __slots__ = (
@@ -343,11 +603,12 @@ class StmtPrintFrame(object):
 
 
 class AthStatementList(list):
-    __slots__ = ('pendant',)
+    __slots__ = ('pendant', 'tails')
 
     def __init__(self, *stmtlist, pendant='THIS'):
         super().__init__(*stmtlist)
         self.pendant = pendant
+        self.tails = None
 
     def __repr__(self):
         return '{}({}, pendant={!r})'.format(
@@ -359,6 +620,28 @@ class AthStatementList(list):
     def iter_nodes(self):
         return AthStatementIter(self)
 
+    def ends_at(self, index):
+        """Returns True if running from index only jumps to the end."""
+        while index < len(self):
+            stmt = self[index]
+            if type(stmt) is not CondiJump or stmt.args[0] is not None:
+                return False
+            index += stmt.args[1] + 1
+        return True
+
+    def tail_positions(self):
+        """Returns the indices of the statements after which the list ends
+        without running anything else, where a function body can make a
+        function call by replacing its own frame with the callee's.
+
+        Worked out on first use, after every load-time pass has run.
+        """
+        if self.tails is None:
+            self.tails = frozenset(
+                index for index in range(len(self)) if self.ends_at(index + 1)
+                )
+        return self.tails
+
     def __eq__(self, other):
         if not isinstance(self, other.__class__):
             return False
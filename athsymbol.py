@@ -1,11 +1,127 @@
 """Contains ~ATH's AST and data structure primitives for easier access."""
 import operator
 from functools import partialmethod
+import weakref
 
 
 def isAthValue(obj):
     """True if an object is a primitive value."""
-    return isinstance(obj, (int, float, complex, str))
+    return isinstance(obj, value_types)
+
+# Strings at least this long start a rope when something is added to them.
+ROPE_MIN_LENGTH = 256
+
+def flatten(value):
+    """Returns a value with any rope joined into a string."""
+    if type(value) is AthRope:
+        return str(value)
+    return value
+
+def concat(lft, rht):
+    """Adds two values, building long strings out of ropes."""
+    if type(lft) is str and type(rht) is str and len(lft) >= ROPE_MIN_LENGTH:
+        return AthRope([lft, rht])
+    return lft + rht
+
+
+class AthRope(object):
+    """A string made by adding strings, kept as the pieces it's made of
+    until it gets used as a string, so building a string a piece at a
+    time takes linear time instead of copying it every time.
+
+    Ropes added to share their list of pieces with the ropes made from
+    them, and only the first rope made from a rope appends to the list.
+    Every other operation acts on the string the pieces join into.
+    """
+    __slots__ = ('parts', 'count', 'text')
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.count = len(parts)
+        self.text = None
+
+    def __str__(self):
+        if self.text is None:
+            parts = self.parts
+            if len(parts) != self.count:
+                parts = parts[:self.count]
+            self.text = ''.join(parts)
+        return self.text
+
+    def pieces(self):
+        """Returns the list of this rope's pieces, for appending to."""
+        if len(self.parts) == self.count:
+            return self.parts
+        return self.parts[:self.count]
+
+    def __add__(self, other):
+        if type(other) is str:
+            parts = self.pieces()
+            parts.append(other)
+        elif type(other) is AthRope:
+            pieces = other.parts[:other.count]
+            parts = self.pieces()
+            parts += pieces
+        else:
+            return str(self) + other
+        return AthRope(parts)
+
+    def __radd__(self, other):
+        if type(other) is str:
+            return AthRope([other, *self.parts[:self.count]])
+        return other + str(self)
+
+    def strop(self, other, op):
+        """Base function for operators, which act on the joined string."""
+        return op(str(self), flatten(other))
+
+    def restrop(self, other, op):
+        """Base function for reverse operators."""
+        return op(flatten(other), str(self))
+
+    __eq__ = partialmethod(strop, op=operator.eq)
+    __ne__ = partialmethod(strop, op=operator.ne)
+    __lt__ = partialmethod(strop, op=operator.lt)
+    __le__ = partialmethod(strop, op=operator.le)
+    __gt__ = partialmethod(strop, op=operator.gt)
+    __ge__ = partialmethod(strop, op=operator.ge)
+
+    __mul__ = partialmethod(strop, op=operator.mul)
+    __rmul__ = partialmethod(restrop, op=operator.mul)
+    __mod__ = partialmethod(strop, op=operator.mod)
+    __rmod__ = partialmethod(restrop, op=operator.mod)
+    __contains__ = partialmethod(strop, op=operator.contains)
+    __getitem__ = partialmethod(strop, op=operator.getitem)
+    __format__ = partialmethod(strop, op=format)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __len__(self):
+        return len(str(self))
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __repr__(self):
+        return repr(str(self))
+
+value_types = (int, float, complex, str, AthRope)
+# Values holding many numbers, which operators act on elementwise.
+vector_types = set()
+
+def add_vector_type(cls):
+    """Lets symbols hold vectors of a type from an optional module."""
+    global value_types
+    if cls not in vector_types:
+        value_types += (cls,)
+        vector_types.add(cls)
+
+def vector_test(result, right=None):
+    """Returns the symbol a vector comparison evaluates to, which holds
+    the result for each element and lives if every one of them held.
+    """
+    return AthSymbol(bool(result.all()), result, right)
 
 
 class SymbolError(Exception):
@@ -16,6 +132,207 @@ class SymbolDeath(Exception):
     """Raised when a symbol dies."""
 
 
+# Bits of AthSymbol.share: whether the symbol is the left or right of
+# another one, which of its own sides still point at symbols it only
+# borrows from the symbol it was REPLICATEd from, and whether it may be
+# below a symbol that some copy borrows.
+LINKED = 1
+BORROWS_LEFT = 2
+BORROWS_RIGHT = 4
+LENT = 8
+borrow_bits = {'left': BORROWS_LEFT, 'right': BORROWS_RIGHT}
+
+
+class SharedLinks(list):
+    """Every borrowed side of a copied symbol, as entries of
+    a weak reference to the copy, the side, and the borrowed symbol.
+
+    Everything below a borrowed symbol is marked as lent, the first time
+    a symbol below another one is mutated after it was borrowed. Marks are
+    never taken off, so everything below a lent symbol is always lent too.
+    Only mutating a lent symbol costs more than a flag test: the copies
+    that reach it through what they borrow get their own copies of the
+    symbols on the way down to it, and keep borrowing the rest.
+    """
+    __slots__ = ('limit', 'frozen', 'searched')
+
+    def __init__(self):
+        super().__init__()
+        self.limit = 1024
+        # Entries before this index have been marked as lent.
+        self.frozen = 0
+        # Symbols walked looking for mutated ones since the last time
+        # everything was copied.
+        self.searched = 0
+
+    @staticmethod
+    def lends(entry):
+        """True if the copy is still around and still borrowing."""
+        sym, side, child = entry
+        sym = sym()
+        return (
+            sym is not None
+            and sym.share & borrow_bits[side]
+            and getattr(sym, side) is child
+            )
+
+    def borrow(self, sym, side, child):
+        sym.share |= borrow_bits[side]
+        self.append((weakref.ref(sym), side, child))
+        if len(self) > self.limit:
+            frozen = [entry for entry in self[:self.frozen] if self.lends(entry)]
+            self[:] = frozen + list(filter(self.lends, self[self.frozen:]))
+            self.frozen = len(frozen)
+            self.limit = max(1024, 2 * len(self))
+
+    @staticmethod
+    def lend(sym):
+        """Marks a symbol and everything below it as lent."""
+        stack = [sym]
+        while stack:
+            sym = stack.pop()
+            if sym.share & LENT:
+                continue
+            sym.share |= LENT
+            if type(sym) is ChainSymbol:
+                # The rest of a chain is lent as a whole, so that its
+                # symbols are lent whenever they're made.
+                chain = sym.chain
+                start, stop = sym.index, chain.lent
+                chain.lent = min(start, stop)
+                values = [chain.end]
+                for index, node in list(chain.nodes.items()):
+                    if start <= index < stop:
+                        node.share |= LENT
+                        if index in chain.pinned:
+                            values += (node.left, node.right)
+            else:
+                values = (sym.left, sym.right)
+            stack += (value for value in values if isinstance(value, AthSymbol))
+
+    def freeze(self):
+        """Marks what was borrowed since the last time as lent."""
+        for sym, side, child in self[self.frozen:]:
+            self.lend(child)
+        self.frozen = len(self)
+
+    def release(self, sym):
+        """Called before mutating a symbol below another one. Each copy
+        that reaches it through what it borrows gets copies of the symbols
+        from what it borrows down to it, as if it had been deep copied.
+        """
+        self.freeze()
+        if not sym.share & LENT:
+            return
+        # Borrowers are held for as long as this runs, since copying a
+        # path can drop the last reference to one still to be handled.
+        entries = [
+            (entry, entry[0]()) for entry in self if self.lends(entry)
+            ]
+        # Walk everything borrowed, noting the symbols above each one.
+        seen = {}
+        parents = {}
+        stack = []
+        for (ref, side, child), borrower in entries:
+            if id(child) not in seen:
+                seen[id(child)] = child
+                stack.append(child)
+        while stack:
+            node = stack.pop()
+            for value in (node.left, node.right):
+                if isinstance(value, AthSymbol):
+                    parents.setdefault(id(value), []).append(node)
+                    if id(value) not in seen:
+                        seen[id(value)] = value
+                        stack.append(value)
+        self.searched += len(seen)
+        if self.searched > 2 * len(seen):
+            # Searching has cost more than copying everything would have,
+            # which mutating many lent symbols in a row leads to.
+            self.materialize()
+            return
+        if id(sym) not in seen:
+            self[:] = [entry for entry, borrower in entries]
+            self.frozen = len(self)
+            return
+        # The symbols that sym is below, and sym itself.
+        above = {id(sym): sym}
+        stack = [sym]
+        while stack:
+            node = stack.pop()
+            for parent in parents.get(id(node), ()):
+                if id(parent) not in above:
+                    above[id(parent)] = parent
+                    stack.append(parent)
+        del self[:]
+        for entry, borrower in entries:
+            ref, side, child = entry
+            if not (
+                borrower.share & borrow_bits[side]
+                and getattr(borrower, side) is child
+                ):
+                continue
+            if id(child) in above:
+                setattr(borrower, side, self.copy_path(child, above))
+                borrower.share &= ~borrow_bits[side]
+            else:
+                self.append(entry)
+        self.frozen = len(self)
+
+    def copy_path(self, child, above):
+        """Copies the symbols of a borrowed graph that are above a mutated
+        one, borrowing the rest. Like AthSymbol.deepcopy, a symbol reached
+        twice is copied twice, and a cycle is copied as a cycle.
+        """
+        top = AthSymbol(child.alive)
+        top.share = LINKED
+        path = {id(child): top}
+        stack = [[child, top, 'left']]
+        while stack:
+            frame = stack[-1]
+            sym, copy, side = frame
+            if side is None:
+                stack.pop()
+                del path[id(sym)]
+                continue
+            frame[2] = 'right' if side == 'left' else None
+            value = getattr(sym, side)
+            if isinstance(value, AthSymbol):
+                if id(value) in path:
+                    value = path[id(value)]
+                elif id(value) in above:
+                    twin = path[id(value)] = AthSymbol(value.alive)
+                    twin.share = LINKED
+                    stack.append([value, twin, 'left'])
+                    value = twin
+                else:
+                    # Entries made here are already lent.
+                    copy.share |= borrow_bits[side]
+                    self.append((weakref.ref(copy), side, value))
+            setattr(copy, side, value)
+        return top
+
+    def materialize(self):
+        """Gives every copy a deep copy of what it borrows, after which
+        nothing is borrowed any more.
+        """
+        entries = self[:]
+        del self[:]
+        self.limit = 1024
+        self.frozen = 0
+        self.searched = 0
+        for entry in entries:
+            if self.lends(entry):
+                sym, side, child = entry
+                sym = sym()
+                child = child.deepcopy()
+                child.share = LINKED
+                setattr(sym, side, child)
+                sym.share &= ~borrow_bits[side]
+
+shared_links = SharedLinks()
+
+
 class AthExpr(object):
     """Base class of all ~ATH AST nodes."""
     __slots__ = ()
@@ -68,11 +385,19 @@ class AthCustomFunction(AthFunction):
 
 
 class AthSymbol(AthExpr):
-    """~ATH Variable data structure."""
-    __slots__ = ('alive', 'left', 'right')
+    """~ATH Variable data structure.
+
+    REPLICATE copies are copy-on-write: a copy borrows the symbols below
+    the one it was made from, and only gets its own copy of one once it's
+    handed out under a name. Before a symbol below something a copy
+    borrows gets mutated, that copy gets its own copies of the symbols
+    on the way down to it, so no mutation is ever seen through a copy.
+    """
+    __slots__ = ('alive', 'left', 'right', 'share', '__weakref__')
 
     def __init__(self, alive=True, left=None, right=None):
         self.alive = alive
+        self.share = 0
         if left is None:
             self.left = None
         else:
@@ -83,23 +408,53 @@ class AthSymbol(AthExpr):
             self.assign_right(right)
 
     def __repr__(self):
-        if isinstance(self.right, AthFunction):
-            rstr = f'<~ATHFunction {self.right.name}>'
-        else:
-            rstr = repr(self.right)
-        return '{}({}, {!r}, {})'.format(
-            self.__class__.__name__,
-            self.alive, self.left, rstr,
-            )
+        # The stack holds text to emit, symbols to expand, and 1-tuples
+        # of symbols whose expansion ends there. A symbol that turns up
+        # inside its own expansion is shown as '...'.
+        parts = []
+        path = set()
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                parts.append(item)
+            elif type(item) is tuple:
+                path.discard(id(item[0]))
+            elif id(item) in path:
+                parts.append('...')
+            elif type(item).__repr__ is not AthSymbol.__repr__:
+                parts.append(repr(item))
+            else:
+                path.add(id(item))
+                left, right = item.left, item.right
+                if not isinstance(left, AthSymbol):
+                    left = repr(left)
+                if isinstance(right, AthFunction):
+                    right = f'<~ATHFunction {right.name}>'
+                elif not isinstance(right, AthSymbol):
+                    right = repr(right)
+                # Chain symbols stand in for plain ones, so print like them.
+                cls = AthSymbol if type(item) is ChainSymbol else type(item)
+                stack += (
+                    (item,), ')', right, ', ', left,
+                    f'{cls.__name__}({item.alive}, ',
+                    )
+        return ''.join(parts)
 
     def cmpop(self, other, op):
         """Base function for comparison operators."""
         if not isAthValue(self.left):
             raise SymbolError('symbol left is not a value')
         if isinstance(other, AthSymbol):
-            return AthSymbol(op(self.left, other.left))
+            result = op(self.left, other.left)
+            if type(result) in vector_types:
+                return vector_test(result)
+            return AthSymbol(result)
         else:
-            return AthSymbol(op(self.left, other), self.left, self.right)
+            result = op(self.left, other)
+            if type(result) in vector_types:
+                return vector_test(result, right=self.right)
+            return AthSymbol(result, self.left, self.right)
 
     def unoop(self, op):
         """Base function for unary operators."""
@@ -126,15 +481,16 @@ class AthSymbol(AthExpr):
         """Base function for in-place binary operators."""
         if not isAthValue(self.left):
             raise SymbolError('symbol left is not a value')
+        self.unshare()
         self.left = op(self.left, other)
         return self
 
     def __bool__(self):
         return self.alive
 
-    __add__ = partialmethod(binop, op=operator.add)
-    __radd__ = partialmethod(reop, op=operator.add)
-    __iadd__ = partialmethod(inop, op=operator.add)
+    __add__ = partialmethod(binop, op=concat)
+    __radd__ = partialmethod(reop, op=concat)
+    __iadd__ = partialmethod(inop, op=concat)
 
     __sub__ = partialmethod(binop, op=operator.sub)
     __rsub__ = partialmethod(reop, op=operator.sub)
@@ -196,36 +552,92 @@ class AthSymbol(AthExpr):
         one of its left or right values, or the left or right values
         of those values if they're also symbols.
 
-        Note that this performs the test recursively, and might be slow
-        for large-scale binary symbol heaps.
-
-        Average time: O(log(n))
-        Worst-case  : O(n)
+        Each symbol below this one is visited once, however many
+        symbols share it, so this is O(n) and safe on cycles.
         """
-        if self.left is symbol or self.right is symbol:
-            # If either side is the symbol, return True.
-            return True
-        elif isinstance(self.left, AthSymbol):
-            # If both values are symbols, return True
-            # if at least one value contains the symbol
-            return (
-                isinstance(self.right, AthSymbol)
-                and symbol in self.right
-                or symbol in self.left
-                )
-        elif isinstance(self.right, AthSymbol):
-            # If only right is a symbol, check that one
-            return symbol in self.right
-        else:
-            # If neither are symbols, return False.
-            return False
+        # Visited symbols are kept by id, and kept alive so that no id
+        # gets reused by a chain symbol made during the walk.
+        seen = {id(self): self}
+        stack = [self]
+        while stack:
+            sym = stack.pop()
+            for value in (sym.left, sym.right):
+                if value is symbol:
+                    return True
+                if isinstance(value, AthSymbol) and id(value) not in seen:
+                    seen[id(value)] = value
+                    stack.append(value)
+        return False
 
 
     def copy(self):
-        """Deep copies this symbol and returns the result."""
-        nleft = self.left.copy() if isinstance(self.left, AthSymbol) else self.left
-        nright = self.right.copy() if isinstance(self.right, AthSymbol) else self.right
-        return AthSymbol(self.alive, nleft, nright)
+        """Copies this symbol, borrowing the symbols below it."""
+        sym = AthSymbol(self.alive)
+        sym.left = left = self.left
+        sym.right = right = self.right
+        if isinstance(left, AthSymbol):
+            shared_links.borrow(sym, 'left', left)
+        if isinstance(right, AthSymbol):
+            shared_links.borrow(sym, 'right', right)
+        return sym
+
+    def deepcopy(self):
+        """Deep copies this symbol and returns the result.
+
+        Like the copies REPLICATE hands out, a symbol reached twice is
+        copied twice, except that a symbol below itself is copied as
+        a cycle back to its own copy.
+        """
+        top = AthSymbol(self.alive)
+        # Symbols being copied, by id, and the stack of those copies,
+        # each with the side to copy next.
+        path = {id(self): top}
+        stack = [[self, top, 'left']]
+        while stack:
+            frame = stack[-1]
+            sym, copy, side = frame
+            if side is None:
+                stack.pop()
+                del path[id(sym)]
+                continue
+            frame[2] = 'right' if side == 'left' else None
+            value = getattr(sym, side)
+            if isinstance(value, AthSymbol):
+                if id(value) in path:
+                    twin = path[id(value)]
+                else:
+                    twin = path[id(value)] = AthSymbol(value.alive)
+                    stack.append([value, twin, 'left'])
+                twin.share |= LINKED
+                value = twin
+            setattr(copy, side, value)
+        return top
+
+    def thaw(self):
+        """Gives this symbol its own copies of the symbols it borrows,
+        which must happen before it's handed out under a name.
+        """
+        if self.share & BORROWS_LEFT:
+            self.left = self.left.copy()
+            self.link(self.left)
+        if self.share & BORROWS_RIGHT:
+            self.right = self.right.copy()
+            self.link(self.right)
+        self.share &= ~(BORROWS_LEFT | BORROWS_RIGHT)
+
+    def unshare(self):
+        """Called before mutating this symbol. If it could be below
+        a symbol some copy borrows, that copy stops borrowing it.
+        """
+        if self.share & LINKED and shared_links:
+            shared_links.release(self)
+
+    def link(self, value):
+        """Called when a symbol becomes this symbol's left or right."""
+        value.share |= LINKED
+        if self.share & LENT:
+            # Whatever is below a lent symbol must be lent too.
+            shared_links.lend(value)
 
     def refcopy(self, ref):
         """Replaces all instances of a reference symbol in
@@ -233,16 +645,40 @@ class AthSymbol(AthExpr):
         """
         if ref is self:
             return self.copy()
-        if isinstance(self.left, AthSymbol):
-            self.left = self.left.refcopy(ref)
-        if isinstance(self.right, AthSymbol):
-            self.right = self.right.refcopy(ref)
+        if not ref.share & LINKED:
+            # Nothing has ref as its left or right, so it can't be below.
+            return self
+        seen = {id(self): self}
+        stack = [self]
+        while stack:
+            sym = stack.pop()
+            for side, bit in borrow_bits.items():
+                value = getattr(sym, side)
+                if not isinstance(value, AthSymbol) or sym.share & bit:
+                    # Borrowed symbols belong to another copy,
+                    # so ref can't be there.
+                    continue
+                if value is ref:
+                    value = ref.copy()
+                    sym.unshare()
+                    sym.link(value)
+                    setattr(sym, side, value)
+                elif id(value) not in seen:
+                    seen[id(value)] = value
+                    stack.append(value)
         return self
 
     def copyfrom(self, other):
+        self.unshare()
+        other.thaw()
         self.alive = other.alive
         self.left = other.left
         self.right = other.right
+        self.share &= ~(BORROWS_LEFT | BORROWS_RIGHT)
+        if self.share & LENT:
+            for value in (self.left, self.right):
+                if isinstance(value, AthSymbol):
+                    shared_links.lend(value)
 
     def assign_left(self, value):
         if not (isAthValue(value)
@@ -252,20 +688,98 @@ class AthSymbol(AthExpr):
             raise TypeError(
                 'May only assign constants or symbols to left'
                 )
+        self.unshare()
+        if isinstance(value, AthSymbol):
+            self.link(value)
         self.left = value
+        self.share &= ~BORROWS_LEFT
 
     def assign_right(self, value):
         if not (isinstance(value, (AthFunction, AthSymbol)) or value is None):
             raise TypeError(
                 'May only assign functions or symbols to right'
                 )
+        self.unshare()
+        if isinstance(value, AthSymbol):
+            self.link(value)
         self.right = value
+        self.share &= ~BORROWS_RIGHT
 
     def kill(self):
         """THIS.DIE()"""
+        self.unshare()
         self.alive = False
 
 
+class SymbolChain(object):
+    """The values of a right-linked list of symbols, which ends in a dead
+    symbol. Its symbols are only made once reached, and then only kept
+    for as long as something refers to them or they've been mutated,
+    so a long list costs little more than its values.
+    """
+    __slots__ = ('values', 'nodes', 'pinned', 'end', 'lent')
+
+    def __init__(self, values):
+        self.values = values
+        self.nodes = weakref.WeakValueDictionary()
+        self.pinned = {}
+        # The index from which the chain's symbols are lent.
+        self.lent = len(values) + 1
+        self.end = AthSymbol(False)
+        self.end.share = LINKED
+
+    def node(self, index):
+        """Returns the symbol at an index, or the end past the last one."""
+        if index == len(self.values):
+            return self.end
+        sym = self.nodes.get(index)
+        if sym is None:
+            sym = self.nodes[index] = ChainSymbol(self, index)
+        return sym
+
+
+class ChainSymbol(AthSymbol):
+    """A symbol of a SymbolChain. Until something is assigned to its right,
+    its right is the next symbol of the chain, made when it's looked up.
+    """
+    __slots__ = ('chain', 'index')
+
+    def __init__(self, chain, index):
+        self.alive = True
+        self.left = chain.values[index]
+        self.share = LINKED if index else 0
+        if index >= chain.lent:
+            self.share |= LENT
+        self.chain = chain
+        self.index = index
+
+    def __getattr__(self, name):
+        # Only called while the right slot is still unset.
+        if name == 'right':
+            return self.chain.node(self.index + 1)
+        raise AttributeError(name)
+
+    def unshare(self):
+        # A mutated symbol can't be made again from the chain's values.
+        self.chain.pinned[self.index] = self
+        super().unshare()
+
+
+def chain_values(sym):
+    """Returns the left values of a list of symbols, up to its dead end.
+    The rest of a chain that nothing has changed is a slice of its values.
+    """
+    if type(sym) is ChainSymbol:
+        chain = sym.chain
+        if not any(index >= sym.index for index in chain.pinned):
+            return chain.values[sym.index:]
+    values = []
+    while isinstance(sym, AthSymbol) and sym.alive:
+        values.append(sym.left)
+        sym = sym.right
+    return values
+
+
 class BuiltinSymbol(AthSymbol):
     __slots__ = ()
 
@@ -273,6 +787,7 @@ class BuiltinSymbol(AthSymbol):
         self.alive = alive
         self.left = left
         self.right = right
+        self.share = 0
 
     @classmethod
     def from_builtin(cls, name, func, bitmask):
@@ -318,5 +833,7 @@ class NullSymbol(BuiltinSymbol):
     def copy(self):
         return AthSymbol(False)
 
+    deepcopy = copy
+
     def refcopy(self):
         return AthSymbol(False)        
@@ -0,0 +1,240 @@
+"""Trace recording JIT for hot ~ATH loops.
+
+Once a loop has iterated often enough, one iteration is run through the
+closure engine while recording which statements ran and where each jump
+went. That path is compiled into a Python function that keeps repeating
+the iteration, with a guard wherever the path could have gone another way.
+When a guard fails, the function leaves the loop frame where the failing
+statement sent it, and the trampoline carries on interpreting from there.
+
+Comparisons deciding branches are specialised for the operand types seen
+while recording, falling back to the generic operator for any others.
+"""
+from athsymbol import AthSymbol, SymbolDeath
+from athstmt import (
+    LiteralToken, IdentifierToken,
+    BnaryExpr, CondiJump, NativeStatement,
+    )
+from athoptimizer import compare_ops, number_types
+from athcompiler import compile_operand, compile_stmt, TieredInterp
+
+# Side exits a trace may take before it is recorded again.
+TRACE_EXIT_LIMIT = 100
+
+
+def operand_kind(env, token):
+    """Returns the type of a number, or ('symbol', type) for a symbol
+    holding a number, that a comparison operand evaluated to while
+    recording, or None for anything else.
+    """
+    if isinstance(token, LiteralToken):
+        value = token.value
+    elif isinstance(token, IdentifierToken):
+        try:
+            value = env.get_symbol(token.name)
+        except NameError:
+            return None
+    else:
+        return None
+    if type(value) in number_types:
+        return type(value)
+    if type(value) is AthSymbol and type(value.left) in number_types:
+        return ('symbol', type(value.left))
+    return None
+
+
+class TraceCompiler(object):
+    """Compiles a recorded path through a loop body into the source of a
+    function repeating it, and the namespace that source runs in.
+    """
+    __slots__ = ('body', 'namespace', 'lines')
+
+    def __init__(self, body):
+        self.body = body
+        self.namespace = {
+            'AthSymbol': AthSymbol,
+            'SymbolDeath': SymbolDeath,
+            }
+        self.lines = []
+
+    def bind(self, name, value):
+        self.namespace[name] = value
+        return name
+
+    def emit(self, *lines):
+        self.lines.extend('        ' + line for line in lines)
+
+    def gen_operand(self, token, name):
+        """Emits code loading an operand into a local variable."""
+        if isinstance(token, LiteralToken):
+            return repr(token.value)
+        self.emit(f'{name} = get_symbol({token.name!r})')
+        return name
+
+    def gen_compare(self, index, cond, kinds):
+        """Emits code testing a comparison between numbers or symbols
+        holding numbers, guarded by the types seen while recording.
+        Returns the name of the local holding whether the test passed.
+        """
+        opr, lft, rht = cond.args
+        generic = self.bind(f'cond_{index}', compile_operand(*self.body[index].argops[0]))
+        names = (self.gen_operand(lft, 'lft'), self.gen_operand(rht, 'rht'))
+        guards, values = [], []
+        for token, name, kind in zip((lft, rht), names, kinds):
+            if isinstance(token, LiteralToken):
+                values.append(name)
+            elif isinstance(kind, tuple):
+                guards.append(f'type({name}) is AthSymbol and type({name}.left) is {kind[1].__name__}')
+                values.append(f'{name}.left')
+            else:
+                guards.append(f'type({name}) is {kind.__name__}')
+                values.append(name)
+        op = self.bind(f'op_{index}', compare_ops[opr])
+        self.emit(
+            f'if {" and ".join(guards)}:',
+            f'    test = {op}({values[0]}, {values[1]})',
+            'else:',
+            f'    test = {generic}(env)',
+            )
+        return 'test'
+
+    def gen_branch(self, index, target, kinds):
+        """Emits a guard that the jump at index goes where it went while
+        recording, leaving the trace if it doesn't.
+        """
+        cond, jlen = self.body[index].args
+        if kinds is not None:
+            test = self.gen_compare(index, cond, kinds)
+        else:
+            generic = self.bind(f'cond_{index}', compile_operand(*self.body[index].argops[0]))
+            self.emit(f'test = {generic}(env)')
+        taken = target != index + 1
+        exit_to = index + 1 if taken else index + 1 + jlen
+        self.emit(
+            f'if {"" if taken else "not "}test:',
+            f'    nodes.index = {exit_to}',
+            '    return True',
+            )
+
+    def gen_stmt(self, index, target):
+        stmt = self.body[index]
+        run = self.bind(f'stmt_{index}', compile_stmt(stmt, index in self.body.tail_positions()))
+        if isinstance(stmt, NativeStatement):
+            # Native statements may jump, so check they jumped the same way.
+            self.emit(
+                f'nodes.index = {index + 1}',
+                f'{run}(env)',
+                f'if nodes.index != {target}:',
+                '    return True',
+                )
+        else:
+            self.emit(f'{run}(env)')
+
+    def compile(self, path, state):
+        """Returns a function running the loop from the top of its body
+        until it ends, or until the iteration leaves the recorded path.
+
+        It returns True if it left the path, with the loop frame set
+        to carry on from where the iteration went instead.
+        """
+        for index, target, kinds in path:
+            stmt = self.body[index]
+            if type(stmt) is CondiJump:
+                if stmt.args[0] is not None:
+                    self.lines.append('    try:')
+                    self.gen_branch(index, target, kinds)
+                else:
+                    continue
+            else:
+                self.lines.append('    try:')
+                self.gen_stmt(index, target)
+            self.lines += [
+                '    except SymbolDeath as exc:',
+                f'        nodes.index = {index + 1}',
+                '        env.kill_frame(exc.args[0])',
+                '        return False',
+                ]
+        source = '\n'.join([
+            'def trace(env, nodes):',
+            '    get_symbol = env.get_symbol',
+            '    while True:',
+            *('    ' + line for line in self.lines),
+            f'        if get_symbol({self.body.pendant!r}).alive == {state}:',
+            f'            nodes.index = {len(self.body)}',
+            '            env.stack.drop()',
+            '            return False',
+            ])
+        exec(compile(source, f'<trace of {self.body.pendant}>', 'exec'), self.namespace)
+        return self.namespace['trace']
+
+
+def compile_trace(body, path, state):
+    """Compiles a path recorded through a loop body."""
+    return TraceCompiler(body).compile(path, state)
+
+
+class TracingInterp(TieredInterp):
+    """Runs ~ATH programs on the trampoline, replacing the iterations of
+    hot loops with traces compiled from a recorded iteration.
+
+    Hot functions are compiled into closures as the tiered engine does.
+    """
+    __slots__ = ('traces',)
+
+    def __init__(self):
+        super().__init__()
+        # Compiled traces and the number of times they were left early,
+        # by loop body, with the bodies themselves kept alive.
+        self.traces = {}
+
+    def record(self, frame, body):
+        """Runs one iteration of a loop, returning the path it took as
+        (index, next index, operand kinds) for each statement run, or None
+        if the iteration was cut short by a death.
+        """
+        code = self.get_block(body)
+        nodes = frame.iter_nodes
+        path = []
+        while nodes.index < len(code):
+            index = nodes.index
+            stmt = body[index]
+            kinds = None
+            if type(stmt) is CondiJump and type(stmt.args[0]) is BnaryExpr:
+                opr, lft, rht = stmt.args[0].args
+                if opr in compare_ops:
+                    kinds = (operand_kind(self, lft), operand_kind(self, rht))
+                    # Comparing two plain values gives a living symbol
+                    # whatever the result, so only specialise on symbols.
+                    if None in kinds or not any(type(kind) is tuple for kind in kinds):
+                        kinds = None
+            nodes.index += 1
+            try:
+                code[index](self)
+            except SymbolDeath as exc:
+                self.kill_frame(exc.args[0])
+                return None
+            path.append((index, nodes.index, kinds))
+        return path
+
+    def tier_up_loop(self, frame, state, body):
+        """Runs a hot loop on its trace, recording one if there is none.
+
+        Either way, control goes back to the trampoline afterwards, at
+        wherever the loop frame was left, or after the loop if it ended.
+        """
+        try:
+            _, trace, exits = self.traces[id(body)]
+        except KeyError:
+            for stmt in body:
+                if type(stmt) is CondiJump and stmt.args[0] is not None and stmt.argops is None:
+                    stmt.classify()
+            path = self.record(frame, body)
+            if path is not None:
+                self.traces[id(body)] = (body, compile_trace(body, path, state), 0)
+            return
+        if trace(self, frame.iter_nodes):
+            if exits >= TRACE_EXIT_LIMIT:
+                # The loop keeps going another way, so record it again.
+                del self.traces[id(body)]
+            else:
+                self.traces[id(body)] = (body, trace, exits + 1)
@@ -0,0 +1,519 @@
+"""Register-based bytecode compiler and virtual machine for ~ATH.
+
+Each statement list compiles to a VMCode object: a flat array of integer
+instructions, a constant pool, a name table, and the offsets where each
+statement starts. Expressions evaluate into numbered registers of the
+frame running them, and EXECUTE and ~ATH loops push explicit frames, so
+the VM never recurses on the Python stack.
+
+Compiled programs can be dumped to and loaded from a marshal file, which
+the interpreter keeps next to the parsed AST cache.
+"""
+import os
+import sys
+import marshal
+from array import array
+from bisect import bisect_right
+from athsymbol import (
+    isAthValue, AthSymbol, SymbolDeath,
+    AthBuiltinFunction, AthCustomFunction,
+    )
+from athstmt import (
+    ath_builtins, ThisSymbol, unops, biops,
+    LiteralToken, IdentifierToken,
+    AthStatement, AthTokenStatement, TildeAthLoop,
+    UnaryExpr, BnaryExpr, CondiJump,
+    )
+from athbuiltins_default import CallSite
+from athgrammar import ath_parser
+from athinterpreter import AthStackFrame, TildeAthInterp
+
+# Bumped whenever the instruction set, the dump format, or the code
+# compiled for a program changes.
+BYTECODE_MAGIC = b'~ATHVM\x03'
+
+# Opcodes, with their operands.
+LOAD_CONST = 0 # dst, const
+LOAD_NAME = 1 # dst, name
+UNARY = 2 # dst, opr, src
+BINARY = 3 # dst, opr, lft, rht
+CALL = 4 # dst, name, base, argc
+EXECUTE = 5 # dst, base, argc, site
+EXECUTE_LAST = 6 # base, argc, site
+TAILCALL = 7 # base, argc, site
+RETURN = 8 # src
+JUMP = 9 # target
+JUMP_DEAD = 10 # src, target
+LOOP = 11 # state, const
+END = 12 #
+
+# Operators are encoded as indices into these.
+unary_oprs = tuple(unops)
+binary_oprs = tuple(biops)
+unary_funcs = tuple(unops[opr] for opr in unary_oprs)
+binary_funcs = tuple(biops[opr] for opr in binary_oprs)
+
+
+class VMCode(object):
+    """A compiled statement list.
+
+    Names used as builtin statements have their functions looked up once,
+    in funcs, which runs parallel to names. Each EXECUTE instruction has
+    its own call site cache in sites.
+    """
+    __slots__ = (
+        'pendant', 'ops', 'consts', 'names', 'funcs', 'sites',
+        'starts', 'returns', 'nregs',
+        )
+
+    def __init__(self, pendant, ops, consts, names, nsites, starts, returns, nregs):
+        self.pendant = pendant
+        self.ops = ops
+        self.consts = consts
+        self.names = names
+        self.funcs = [
+            ath_builtins[name].right if name in ath_builtins else None
+            for name in names
+            ]
+        self.sites = [CallSite() for _ in range(nsites)]
+        self.starts = starts
+        self.returns = returns
+        self.nregs = nregs
+
+    def __repr__(self):
+        return '<{} for {} with {} ops>'.format(
+            self.__class__.__name__, self.pendant, len(self.ops),
+            )
+
+    def next_stmt(self, pc):
+        """Returns the index of the statement the instruction at pc is
+        part of, and the offset of the statement after it.
+        """
+        index = bisect_right(self.starts, pc) - 1
+        if index + 1 < len(self.starts):
+            return index, self.starts[index + 1]
+        return index, len(self.ops) - 1
+
+    def dump(self):
+        """Returns this code as nested tuples of marshallable values."""
+        consts = []
+        for const in self.consts:
+            if isinstance(const, VMCode):
+                consts.append(('code', const.dump()))
+            elif isinstance(const, AthCustomFunction):
+                consts.append((
+                    'function', const.name, tuple(const.argfmt), const.body.dump(),
+                    ))
+            else:
+                consts.append(const)
+        return (
+            self.pendant, self.ops.tobytes(), tuple(consts), tuple(self.names),
+            len(self.sites), tuple(self.starts), tuple(sorted(self.returns)), self.nregs,
+            )
+
+    @classmethod
+    def load(cls, dump):
+        """Rebuilds code from the result of dump."""
+        pendant, opbytes, dumped, names, nsites, starts, returns, nregs = dump
+        ops = array('l')
+        ops.frombytes(opbytes)
+        consts = []
+        for const in dumped:
+            if isinstance(const, tuple):
+                if const[0] == 'code':
+                    const = cls.load(const[1])
+                else:
+                    _, name, argfmt, body = const
+                    const = AthCustomFunction(name, list(argfmt), cls.load(body))
+            consts.append(const)
+        return cls(
+            pendant, ops, consts, list(names), nsites,
+            list(starts), frozenset(returns), nregs,
+            )
+
+
+class VMCompiler(object):
+    """Compiles one statement list into a VMCode object."""
+    __slots__ = (
+        'ops', 'consts', 'const_ids', 'names', 'name_ids', 'nsites', 'jumps', 'nregs',
+        )
+
+    def __init__(self):
+        self.ops = array('l')
+        self.consts = []
+        self.const_ids = {}
+        self.names = []
+        self.name_ids = {}
+        self.nsites = 0
+        # Jump operands to patch, with the statements they jump to.
+        self.jumps = []
+        self.nregs = 1
+
+    def const(self, value):
+        if isinstance(value, (AthStatement, AthCustomFunction, VMCode)):
+            self.consts.append(value)
+            return len(self.consts) - 1
+        # Keep equal values of different types apart, like 1 and 1.0.
+        key = (type(value), value)
+        try:
+            return self.const_ids[key]
+        except KeyError:
+            self.consts.append(value)
+            self.const_ids[key] = len(self.consts) - 1
+            return self.const_ids[key]
+
+    def name(self, name):
+        try:
+            return self.name_ids[name]
+        except KeyError:
+            self.names.append(name)
+            self.name_ids[name] = len(self.names) - 1
+            return self.name_ids[name]
+
+    def site(self):
+        self.nsites += 1
+        return self.nsites - 1
+
+    def emit(self, *ops):
+        self.ops.extend(ops)
+
+    def use_regs(self, count):
+        self.nregs = max(self.nregs, count)
+
+    def compile_value(self, arg, dst, free, is_name=False):
+        """Emits code leaving the value of an argument in register dst,
+        using only registers from free upward as temporaries.
+        """
+        self.use_regs(dst + 1)
+        if isinstance(arg, LiteralToken):
+            self.emit(LOAD_CONST, dst, self.const(arg.value))
+        elif isinstance(arg, IdentifierToken):
+            if is_name:
+                self.emit(LOAD_CONST, dst, self.const(arg.name))
+            else:
+                self.emit(LOAD_NAME, dst, self.name(arg.name))
+        elif isinstance(arg, AthStatement):
+            self.compile_expr(arg, dst, free)
+        elif isinstance(arg, AthCustomFunction):
+            body = compile_code(arg.body)
+            self.emit(LOAD_CONST, dst, self.const(
+                AthCustomFunction(arg.name, arg.argfmt, body)
+                ))
+        else:
+            self.emit(LOAD_CONST, dst, self.const(arg))
+
+    def compile_args(self, stmt, base):
+        """Emits code leaving the values of a statement's arguments
+        in consecutive registers starting from base.
+        """
+        bitmask = stmt.func.bitmask
+        argc = len(stmt.args)
+        for index, arg in enumerate(stmt.args):
+            is_name = bitmask < 0 or bitmask & (1 << index)
+            self.compile_value(arg, base + index, base + argc, is_name)
+        return argc
+
+    def compile_expr(self, stmt, dst, free):
+        """Emits code leaving the value of an expression in register dst."""
+        if type(stmt) is UnaryExpr:
+            opr, val = stmt.args
+            self.compile_value(val, dst, free)
+            self.emit(UNARY, dst, unary_oprs.index(opr), dst)
+        elif type(stmt) is BnaryExpr:
+            opr, lft, rht = stmt.args
+            self.compile_value(lft, dst, free + 1)
+            self.compile_value(rht, free, free + 1)
+            self.emit(BINARY, dst, binary_oprs.index(opr), dst, free)
+        elif isinstance(stmt, AthTokenStatement) and stmt.name == 'EXECUTE':
+            argc = self.compile_args(stmt, free)
+            self.emit(EXECUTE, dst, free, argc, self.site())
+        else:
+            argc = self.compile_args(stmt, free)
+            self.emit(CALL, dst, self.name(stmt.name), free, argc)
+
+    def compile_stmt(self, stmt, index, is_tail):
+        if isinstance(stmt, TildeAthLoop):
+            body = compile_code(stmt.body)
+            self.emit(LOOP, int(stmt.state), self.const(body))
+        elif isinstance(stmt, CondiJump):
+            cond, jlen = stmt.args
+            if cond is None:
+                self.emit(JUMP, 0)
+            else:
+                self.compile_value(cond, 0, 1)
+                self.emit(JUMP_DEAD, 0, 0)
+            self.jumps.append((len(self.ops) - 1, index + 1 + jlen))
+        elif isinstance(stmt, AthTokenStatement) and stmt.name == 'DIVULGATE':
+            expr, = stmt.args
+            if isinstance(expr, AthTokenStatement) and expr.name == 'EXECUTE':
+                argc = self.compile_args(expr, 0)
+                self.emit(TAILCALL, 0, argc, self.site())
+            else:
+                self.compile_value(expr, 0, 1)
+                self.emit(RETURN, 0)
+        elif isinstance(stmt, AthTokenStatement) and stmt.name == 'EXECUTE' and is_tail:
+            argc = self.compile_args(stmt, 0)
+            self.emit(EXECUTE_LAST, 0, argc, self.site())
+        else:
+            self.compile_expr(stmt, 0, 1)
+
+    def compile(self, stmts):
+        starts = []
+        returns = set()
+        tails = stmts.tail_positions()
+        for index, stmt in enumerate(stmts):
+            starts.append(len(self.ops))
+            if isinstance(stmt, AthTokenStatement) and stmt.name == 'DIVULGATE':
+                returns.add(index)
+            self.compile_stmt(stmt, index, index in tails)
+        end = len(self.ops)
+        self.emit(END)
+        for operand, target in self.jumps:
+            # Jumps past the end of the list end it, like running off it does.
+            self.ops[operand] = starts[target] if 0 <= target < len(starts) else end
+        return VMCode(
+            stmts.pendant, self.ops, self.consts, self.names, self.nsites,
+            starts, frozenset(returns), self.nregs,
+            )
+
+
+def compile_code(stmts):
+    """Compiles a statement list into bytecode."""
+    return VMCompiler().compile(stmts)
+
+
+def dump_code(code, fname):
+    with open(fname, 'wb') as codefile:
+        marshal.dump((BYTECODE_MAGIC, code.dump()), codefile)
+
+
+def load_code(fname):
+    """Loads bytecode dumped by dump_code, or returns None if the file
+    was dumped by a different version of the VM.
+    """
+    with open(fname, 'rb') as codefile:
+        try:
+            magic, dump = marshal.load(codefile)
+        except (EOFError, ValueError, TypeError):
+            return None
+    if magic != BYTECODE_MAGIC:
+        return None
+    return VMCode.load(dump)
+
+
+class VMFrame(AthStackFrame):
+    """A stack frame that also holds the code it runs, where it is in that
+    code, its registers, and the caller register its return value goes to.
+    """
+    __slots__ = ('code', 'ops', 'pc', 'regs', 'ret_reg')
+
+    def __init__(self, code, scope_vars=None, exec_state=0, ret_reg=-1):
+        super().__init__(scope_vars=scope_vars, exec_state=exec_state)
+        self.set_code(code)
+        self.ret_reg = ret_reg
+
+    def set_code(self, code):
+        self.code = code
+        self.ops = code.ops
+        self.pc = 0
+        self.regs = [None] * code.nregs
+
+
+class BytecodeInterp(TildeAthInterp):
+    """Runs ~ATH programs compiled to bytecode on a register machine."""
+    __slots__ = ('handlers',)
+
+    def __init__(self):
+        super().__init__()
+        # Instruction handlers by opcode. Each takes the running frame and
+        # the offset of its instruction, and returns the offset of the next
+        # one, or None after changing which frame runs next.
+        self.handlers = [
+            self.load_const, self.load_name, self.unary, self.binary,
+            self.call, self.execute, self.execute_last, self.tailcall,
+            self.divulgate, self.jump, self.jump_dead, self.tildeath,
+            self.end,
+            ]
+
+    def load_const(self, frame, pc):
+        ops = frame.ops
+        frame.regs[ops[pc + 1]] = frame.code.consts[ops[pc + 2]]
+        return pc + 3
+
+    def load_name(self, frame, pc):
+        ops = frame.ops
+        frame.regs[ops[pc + 1]] = self.get_symbol(frame.code.names[ops[pc + 2]])
+        return pc + 3
+
+    def unary(self, frame, pc):
+        ops, regs = frame.ops, frame.regs
+        ans = unary_funcs[ops[pc + 2]](regs[ops[pc + 3]])
+        regs[ops[pc + 1]] = AthSymbol(left=ans) if isAthValue(ans) else ans
+        return pc + 4
+
+    def binary(self, frame, pc):
+        ops, regs = frame.ops, frame.regs
+        ans = binary_funcs[ops[pc + 2]](regs[ops[pc + 3]], regs[ops[pc + 4]])
+        regs[ops[pc + 1]] = AthSymbol(left=ans) if isAthValue(ans) else ans
+        return pc + 5
+
+    def call(self, frame, pc):
+        ops, regs = frame.ops, frame.regs
+        base = ops[pc + 3]
+        regs[ops[pc + 1]] = frame.code.funcs[ops[pc + 2]](
+            self, *regs[base:base + ops[pc + 4]]
+            )
+        return pc + 5
+
+    def get_call(self, frame, base, argc, site):
+        """Returns the function and arguments of an EXECUTE statement."""
+        return frame.code.sites[site](self, *frame.regs[base:base + argc])
+
+    def push_call(self, func, scope_vars, ret_reg):
+        self.stack.append(VMFrame(
+            func.body, scope_vars, self.FUNCEXEC_STATE, ret_reg,
+            ))
+
+    def replace_call(self, frame, func, scope_vars):
+        """Makes a tail call by reusing the running frame for the function."""
+        self.stack.replace_scope(scope_vars)
+        frame.exec_state = self.FUNCEXEC_STATE
+        frame.set_code(func.body)
+
+    def return_value(self, value):
+        """Pops the running frame, handing a value to its caller."""
+        frame = self.stack.pop()
+        if not self.stack:
+            raise RuntimeError('All stack frames destroyed!!!!!')
+        if frame.ret_reg >= 0:
+            self.stack[-1].regs[frame.ret_reg] = value
+
+    def execute(self, frame, pc):
+        ops = frame.ops
+        func, scope_vars = self.get_call(frame, ops[pc + 2], ops[pc + 3], ops[pc + 4])
+        if isinstance(func, AthBuiltinFunction):
+            frame.regs[ops[pc + 1]] = func(self, *scope_vars)
+            return pc + 5
+        frame.pc = pc + 5
+        self.push_call(func, scope_vars, ops[pc + 1])
+
+    def execute_last(self, frame, pc):
+        ops = frame.ops
+        func, scope_vars = self.get_call(frame, ops[pc + 1], ops[pc + 2], ops[pc + 3])
+        if isinstance(func, AthBuiltinFunction):
+            func(self, *scope_vars)
+            return pc + 4
+        if frame.exec_state == self.FUNCEXEC_STATE:
+            self.replace_call(frame, func, scope_vars)
+            return
+        frame.pc = pc + 4
+        self.push_call(func, scope_vars, -1)
+
+    def tailcall(self, frame, pc):
+        ops = frame.ops
+        func, scope_vars = self.get_call(frame, ops[pc + 1], ops[pc + 2], ops[pc + 3])
+        if isinstance(func, AthBuiltinFunction):
+            self.return_value(func(self, *scope_vars))
+            return
+        self.replace_call(frame, func, scope_vars)
+
+    def divulgate(self, frame, pc):
+        value = frame.regs[frame.ops[pc + 1]]
+        if value is None:
+            return pc + 2
+        self.return_value(value)
+
+    def jump(self, frame, pc):
+        return frame.ops[pc + 1]
+
+    def jump_dead(self, frame, pc):
+        ops = frame.ops
+        if frame.regs[ops[pc + 1]]:
+            return pc + 3
+        return ops[pc + 2]
+
+    def tildeath(self, frame, pc):
+        ops = frame.ops
+        state = ops[pc + 1]
+        body = frame.code.consts[ops[pc + 2]]
+        if self.get_symbol(body.pendant).alive == state:
+            return pc + 3
+        frame.pc = pc + 3
+        self.stack.append(VMFrame(body, exec_state=self.TILDEATH_STATE + state))
+
+    def end(self, frame, pc):
+        state = frame.exec_state
+        if state == self.TOPLEVEL_STATE:
+            sys.exit(0)
+        if state == self.FUNCEXEC_STATE:
+            self.return_value(AthSymbol(False))
+            return
+        if self.get_symbol(frame.code.pendant).alive == (state == self.TILALIVE_STATE):
+            self.stack.pop()
+            return
+        return 0
+
+    def on_death(self, graves):
+        """Handles the death of symbols in the running frame, whose pc is
+        just past the start of the instruction that killed them.
+        """
+        while True:
+            if 'THIS' in graves:
+                # End the program only when THIS is killed.
+                sys.exit(0)
+            frame = self.stack[-1]
+            if frame.code.pendant in graves:
+                state = frame.exec_state
+                if state == self.TILALIVE_STATE:
+                    # If in keep-dead loop, force the loop to repeat.
+                    frame.pc = 0
+                    if 0 in frame.code.returns:
+                        self.return_value(AthSymbol(False))
+                    return
+                self.stack.pop()
+                if state == self.FUNCEXEC_STATE:
+                    # Killing a function kills it again in the caller.
+                    for grave in graves:
+                        self.get_symbol(grave).kill()
+                    continue
+                return
+            # Otherwise, skip the rest of the statement.
+            index, frame.pc = frame.code.next_stmt(frame.pc - 1)
+            if index in frame.code.returns:
+                self.return_value(AthSymbol(False))
+            return
+
+    def run(self):
+        handlers = self.handlers
+        while True:
+            frame = self.stack[-1]
+            ops = frame.ops
+            pc = frame.pc
+            try:
+                while pc is not None:
+                    pc = handlers[ops[pc]](frame, pc)
+            except SymbolDeath as exc:
+                frame.pc = pc + 1
+                self.on_death(exc.args[0])
+
+    def exec_code(self, fname, code):
+        ath_builtins['THIS'] = ThisSymbol(fname, code)
+        self.stack.append(VMFrame(code))
+        self.run()
+
+    def exec_stmts(self, fname, stmts):
+        self.exec_code(fname, compile_code(stmts))
+
+    def interpret(self, fname, force):
+        if not fname.endswith('.~ATH'):
+            sys.stderr.write('IOError: script must be a ~ATH file')
+            sys.exit(IOError)
+        codename = f'bc_{fname[:-5]}.athc'
+        code = None
+        if not force and os.path.isfile(codename):
+            code = load_code(codename)
+        if code is None:
+            with open(os.path.join('script', fname), 'r') as script_file:
+                code = compile_code(ath_parser(script_file.read()))
+            dump_code(code, codename)
+        self.exec_code(fname, code)